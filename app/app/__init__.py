@@ -36,6 +36,8 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
         if app.config['ELASTICSEARCH_URL'] else None
+    from app.search import make_backend
+    app.search_backend = make_backend(app)
 
     cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -4,22 +4,42 @@ from flask_restful import Api
 bp = Blueprint('api', __name__)
 api = Api(bp)
 
-from .follower import FollowedDetail, FollowedList, FollowerList
-from .post import PostDetail, PostList
-from .token import Token
-from .user import UserDetail, UserList
+from .follower import FollowedDetail, FollowedList, FollowerList, \
+    FollowerListStream
+from .message import ConversationList, ConversationMessages
+from .post import PostBatch, PostDetail, PostList, PostListBatch, \
+    PostListStream
+from .token import Token, TokenRefresh
+from .user import UserDetail, UserList, UserSuggest
 from .errors import exceptions
 from .errors.handlers import error_response
+from app.pagination import InvalidCursor, InvalidTotalMode
+from app.passwords import PasswordHashingBusy
+from app.serializers import InvalidFields, InvalidIds
 
 
 api.add_resource(UserDetail, '/users/<int:user_id>', endpoint='user_detail')
 api.add_resource(UserList, '/users', endpoint='user_list')
+api.add_resource(UserSuggest, '/users/suggest', endpoint='user_suggest')
 api.add_resource(Token, '/tokens', endpoint='tokens')
+api.add_resource(TokenRefresh, '/tokens/refresh', endpoint='token_refresh')
 api.add_resource(PostList, '/users/<int:user_id>/posts', endpoint='post_list')
+api.add_resource(PostListStream, '/users/<int:user_id>/posts.ndjson',
+                 endpoint='post_list_stream')
+api.add_resource(PostListBatch, '/users/<int:user_id>/posts:batch',
+                 endpoint='post_list_batch')
+api.add_resource(PostBatch, '/posts', endpoint='post_batch')
 api.add_resource(PostDetail, '/users/<int:user_id>/posts/<int:post_id>',
                  endpoint='post_detail')
 api.add_resource(FollowerList, '/users/<int:user_id>/followers',
                  endpoint='follower_list')
+api.add_resource(FollowerListStream, '/users/<int:user_id>/followers.ndjson',
+                 endpoint='follower_list_stream')
+api.add_resource(ConversationList, '/users/<int:user_id>/conversations',
+                 endpoint='conversation_list')
+api.add_resource(ConversationMessages,
+                 '/users/<int:user_id>/conversations/<int:conversation_id>'
+                 '/messages', endpoint='conversation_messages')
 api.add_resource(FollowedList, '/users/<int:user_id>/followed',
                  endpoint='followed_list')
 api.add_resource(FollowedDetail,
@@ -31,3 +51,9 @@ bp.register_error_handler(exceptions.UsernameAlreadyUsed, error_response)
 bp.register_error_handler(exceptions.EmailAddressAlreadyUsed, error_response)
 bp.register_error_handler(exceptions.UserRequiredFieldsIsMissed, error_response)
 bp.register_error_handler(exceptions.UserIdFieldIsMissed, error_response)
+bp.register_error_handler(exceptions.PostBatchIsInvalid, error_response)
+bp.register_error_handler(InvalidCursor, error_response)
+bp.register_error_handler(InvalidTotalMode, error_response)
+bp.register_error_handler(InvalidFields, error_response)
+bp.register_error_handler(InvalidIds, error_response)
+bp.register_error_handler(PasswordHashingBusy, error_response)
@@ -1,21 +1,45 @@
-from flask import g
+from flask import abort, current_app, g
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from werkzeug.exceptions import Unauthorized
 
+from app import db
 from app.models import User
+from app.tokens import decode_token
 
 
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
 
 
+class TokenUser(object):
+    """The user of a signed access token.
+
+    Only the id is known without a query, the row is loaded on first access
+    to any other attribute.
+    """
+
+    def __init__(self, id):
+        self.id = id
+        self._user = None
+
+    def __getattr__(self, name):
+        if self._user is None:
+            self._user = User.load(self.id)
+            if self._user is None:
+                abort(404)
+        return getattr(self._user, name)
+
+
 @basic_auth.verify_password
 def veryfy_password(username, password):
-    user = User.query.filter_by(username=username).first()
+    user = User.load_by_username(username)
     if user is None:
         return False
     g.current_user = user
-    return user.check_password(password)
+    if not user.check_password(password):
+        return False
+    db.session.commit()
+    return True
 
 
 @basic_auth.error_handler
@@ -25,7 +49,15 @@ def basic_auth_error():
 
 @token_auth.verify_token
 def verify_token(token):
-    g.current_user = User.check_token(token) if token else None
+    g.current_user = None
+    if not token:
+        return False
+    if current_app.config['TOKEN_MODE'] == 'jwt':
+        g.token_claims = decode_token(token, 'access')
+        if g.token_claims is not None:
+            g.current_user = TokenUser(g.token_claims['sub'])
+    else:
+        g.current_user = User.check_token(token)
     return g.current_user is not None
 
 
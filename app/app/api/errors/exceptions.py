@@ -19,3 +19,7 @@ class EmailAddressAlreadyUsed(BadRequest):
 
 class UserRequiredFieldsIsMissed(BadRequest):
     description = 'must include username, email and password fields'
+
+
+class PostBatchIsInvalid(BadRequest):
+    description = 'must be a JSON array or NDJSON stream of posts'
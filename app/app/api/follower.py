@@ -2,7 +2,11 @@ from flask import jsonify, request
 from flask_restful import Resource
 
 from .auth import token_auth
+from app.conditional import cache_headers, collection_etag, not_modified
 from app.models import User
+from app.presence import buffered_last_seen
+from app.serializers import parse_fields
+from app.streaming import ndjson_response
 
 
 class FollowerList(Resource):
@@ -14,9 +18,32 @@ class FollowerList(Resource):
         user = User.query.get_or_404(user_id)
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 100)
-        data = User.to_collection_dict(user.followers, page, per_page,
-                                       'api.follower_list', user_id=user_id)
-        return jsonify(data)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        total = request.args.get('total', 'exact')
+        fields = parse_fields(request.args.get('fields'))
+        etag = collection_etag(user, user.followers, per_page, page, after,
+                               before, (total, fields),
+                               overlay=buffered_last_seen)
+        response = not_modified(etag)
+        if response is None:
+            response = jsonify(User.to_collection_dict(
+                user.followers, page, per_page, 'api.follower_list',
+                after=after, before=before, total=total, fields=fields,
+                user_id=user_id))
+        return cache_headers(response, etag)
+
+
+class FollowerListStream(Resource):
+    method_decorators = {
+        'get': [token_auth.login_required]
+    }
+
+    def get(self, user_id):
+        user = User.query.get_or_404(user_id)
+        serializer = User.serializer(
+            only=parse_fields(request.args.get('fields')))
+        return ndjson_response(user.followers, serializer)
 
 
 class FollowedDetail(Resource):
@@ -40,8 +67,14 @@ class FollowedList(Resource):
         user = User.query.get_or_404(user_id)
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 100)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        total = request.args.get('total', 'exact')
+        fields = parse_fields(request.args.get('fields'))
         data = User.to_collection_dict(user.followed, page, per_page,
-                                       'api.followed_list', user_id=user_id)
+                                       'api.followed_list', after=after,
+                                       before=before, total=total,
+                                       fields=fields, user_id=user_id)
         return jsonify(data)
 
     # Follow action
@@ -0,0 +1,47 @@
+from flask import jsonify, request
+from flask_restful import Resource
+
+from .auth import token_auth
+from .permissions import CanReadMessages, allows
+from app.models import InboxEntry, Message, User
+from app.serializers import parse_fields
+
+
+def _collection_args():
+    # Counting a large inbox is not constant time, so totals are opt-in.
+    return {
+        'page': request.args.get('page', 1, type=int),
+        'per_page': min(request.args.get('per_page', 10, type=int), 100),
+        'after': request.args.get('after'),
+        'before': request.args.get('before'),
+        'total': request.args.get('total', 'none'),
+        'fields': parse_fields(request.args.get('fields')),
+        'expand': parse_fields(request.args.get('expand')),
+    }
+
+
+class ConversationList(Resource):
+    method_decorators = {
+        'get': [allows.requires(CanReadMessages()), token_auth.login_required]
+    }
+
+    def get(self, user_id):
+        """Return the conversations of a user, the latest message first."""
+        return jsonify(User.to_collection_dict(
+            InboxEntry.query.filter_by(user_id=user_id),
+            endpoint='api.conversation_list', user_id=user_id,
+            **_collection_args()))
+
+
+class ConversationMessages(Resource):
+    method_decorators = {
+        'get': [allows.requires(CanReadMessages()), token_auth.login_required]
+    }
+
+    def get(self, user_id, conversation_id):
+        """Return the messages of a conversation, the latest first."""
+        InboxEntry.query.get_or_404((user_id, conversation_id))
+        return jsonify(User.to_collection_dict(
+            Message.query.filter_by(conversation_id=conversation_id),
+            endpoint='api.conversation_messages', user_id=user_id,
+            conversation_id=conversation_id, **_collection_args()))
@@ -35,9 +35,17 @@ class CanCreatePost(UserRequirementMixin, Requirement):
         return identity.id == data['user_id']
 
 
+class CanCreatePosts(UserRequirementMixin, Requirement):
+    pass
+
+
 class CanUpdatePost(CanCreatePost):
     pass
 
 
 class CanDeletePost(CanCreatePost):
     pass
+
+
+class CanReadMessages(UserRequirementMixin, Requirement):
+    pass
@@ -1,12 +1,20 @@
-from flask import jsonify, request, url_for
+import json
+
+from flask import current_app, jsonify, request, url_for
 from flask_restful import Resource
 
 from app import db
+from app.conditional import cache_headers, collection_etag, make_etag, \
+    not_modified
 from .auth import token_auth
-from .permissions import CanCreatePost, CanUpdatePost, CanDeletePost, allows
+from .permissions import CanCreatePost, CanCreatePosts, CanUpdatePost, \
+    CanDeletePost, allows
 from app.models import Post, User
-from .errors.exceptions import PostRequiredFieldsIsMissed
+from app.presence import buffered_last_seen
+from .errors.exceptions import PostBatchIsInvalid, PostRequiredFieldsIsMissed
 from .schemas import PostSchema
+from app.serializers import parse_fields, parse_ids
+from app.streaming import ndjson_response
 
 
 class PostDetail(Resource):
@@ -19,8 +27,17 @@ class PostDetail(Resource):
     }
 
     def get(self, user_id, post_id):
+        fields = parse_fields(request.args.get('fields'))
+        expand = parse_fields(request.args.get('expand'))
+        serializer = Post.serializer(only=fields, expand=expand)
         post = Post.query.get_or_404(post_id)
-        return self.post_schema.jsonify(post)
+        author = (post.author.version, buffered_last_seen(
+            [post.user_id]).get(post.user_id)) if expand else None
+        etag = make_etag('post', post.id, post.version, fields, expand,
+                         author)
+        response = not_modified(etag) or \
+            jsonify(serializer.serialize([post])[0])
+        return cache_headers(response, etag)
 
     def put(self, user_id, post_id):
         post = Post.query.get_or_404(post_id)
@@ -47,13 +64,27 @@ class PostList(Resource):
     }
 
     def get(self, user_id):
-        User.query.get_or_404(user_id)
+        user = User.query.get_or_404(user_id)
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 100)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        total = request.args.get('total', 'exact')
+        fields = parse_fields(request.args.get('fields'))
+        expand = parse_fields(request.args.get('expand'))
         posts_query = Post.query.filter_by(user_id=user_id)
-        data = User.to_collection_dict(posts_query, page, per_page,
-                                       'api.post_list', user_id=user_id)
-        return jsonify(data)
+        # Embedded authors are the owner, whose last_seen may be buffered.
+        last_seen = buffered_last_seen([user.id]) \
+            if expand and 'author' in expand else None
+        etag = collection_etag(user, posts_query, per_page, page, after,
+                               before, (total, fields, expand, last_seen))
+        response = not_modified(etag)
+        if response is None:
+            response = jsonify(User.to_collection_dict(
+                posts_query, page, per_page, 'api.post_list', after=after,
+                before=before, total=total, fields=fields, expand=expand,
+                user_id=user_id))
+        return cache_headers(response, etag)
 
     def post(self, user_id):
         user = User.query.get_or_404(user_id)
@@ -69,3 +100,97 @@ class PostList(Resource):
         response.headers['Location'] = url_for(
             'api.post_detail', user_id=user.id, post_id=post.id)
         return response
+
+
+class PostBatch(Resource):
+    method_decorators = {
+        'get': [token_auth.login_required]
+    }
+
+    def get(self):
+        return jsonify(Post.to_batch_dict(
+            Post.query, parse_ids(request.args.get('ids')),
+            fields=parse_fields(request.args.get('fields')),
+            expand=parse_fields(request.args.get('expand'))))
+
+
+class PostListStream(Resource):
+    method_decorators = {
+        'get': [token_auth.login_required]
+    }
+
+    def get(self, user_id):
+        User.query.get_or_404(user_id)
+        serializer = Post.serializer(
+            only=parse_fields(request.args.get('fields')),
+            expand=parse_fields(request.args.get('expand')))
+        return ndjson_response(Post.query.filter_by(user_id=user_id),
+                               serializer)
+
+
+class PostListBatch(Resource):
+    method_decorators = {
+        'post': [allows.requires(CanCreatePosts()), token_auth.login_required]
+    }
+
+    def post(self, user_id):
+        user = User.query.get_or_404(user_id)
+        items = self.parse_items()
+        results = [self.validate(item, user_id) for item in items]
+        valid = [item for item, error in zip(items, results) if error is None]
+        posts = iter(Post.create_many(user, valid))
+        for i, error in enumerate(results):
+            if error is None:
+                post = next(posts)
+                results[i] = {
+                    'status': 201,
+                    'id': post.id,
+                    '_links': {'self': url_for('api.post_detail',
+                                               user_id=user_id,
+                                               post_id=post.id)}
+                }
+            else:
+                results[i] = {'status': 400, 'message': error}
+        response = jsonify({
+            'items': results,
+            '_meta': {'created': len(valid),
+                      'failed': len(items) - len(valid)}
+        })
+        response.status_code = 201 if len(valid) == len(items) else 207
+        return response
+
+    @staticmethod
+    def parse_items():
+        """Read a JSON array, or one JSON post per line for NDJSON bodies."""
+        try:
+            if request.mimetype == 'application/x-ndjson':
+                items = [json.loads(line) for line in
+                         request.get_data(as_text=True).splitlines()
+                         if line.strip()]
+            else:
+                items = request.get_json(force=True, silent=True)
+        except ValueError:
+            raise PostBatchIsInvalid
+        if not isinstance(items, list) or not items or \
+                len(items) > current_app.config['POST_BATCH_LIMIT']:
+            raise PostBatchIsInvalid
+        return items
+
+    @staticmethod
+    def validate(item, user_id):
+        """Return why a batch item can not be created, or None."""
+        if not isinstance(item, dict):
+            return 'must be a JSON object'
+        body = item.get('body')
+        if not isinstance(body, str) or not body.strip():
+            return 'must include post body'
+        if len(body) > Post.body.type.length:
+            return 'post body is too long'
+        if item.get('user_id', user_id) != user_id:
+            return 'user_id must match the user of the URL'
+        language = item.get('language')
+        if language is not None and not (
+                isinstance(language, str) and
+                len(language) <= Post.language.type.length):
+            return 'invalid language'
+        return None
@@ -15,7 +15,7 @@ class PostSchema(ma.ModelSchema):
     class Meta:
         model = Post
         include_fk = True
-        exclude = ('author',)
+        exclude = ('author', 'version')
 
     timestamp = IsoDateTimeField(dump_only=True)
     _links = ma.Hyperlinks({
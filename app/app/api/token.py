@@ -1,10 +1,29 @@
-from flask import g, jsonify
+from flask import current_app, g, jsonify, request
 from flask_restful import Resource
+from redis.exceptions import RedisError
+from werkzeug.exceptions import ServiceUnavailable, Unauthorized
 
 from app import db
+from app.tokens import decode_token, encode_token, revoke_jti
 from .auth import basic_auth, token_auth
 
 
+def signed_tokens_response(user_id):
+    token, expiration = encode_token(user_id, 'access')
+    refresh_token, _ = encode_token(user_id, 'refresh')
+    return jsonify({'token': token,
+                    'refresh_token': refresh_token,
+                    'user_id': user_id,
+                    'token_expiration': expiration})
+
+
+def revoke_signed(claims):
+    try:
+        revoke_jti(claims['jti'], claims['exp'])
+    except RedisError:
+        raise ServiceUnavailable
+
+
 class Token(Resource):
     method_decorators = {
         'post': [basic_auth.login_required],
@@ -12,6 +31,8 @@ class Token(Resource):
     }
 
     def post(self):
+        if current_app.config['TOKEN_MODE'] == 'jwt':
+            return signed_tokens_response(g.current_user.id)
         token = g.current_user.get_token()
         expiration = g.current_user.token_expiration
         db.session.commit()
@@ -20,6 +41,30 @@ class Token(Resource):
                         'token_expiration': expiration})
 
     def delete(self):
+        if current_app.config['TOKEN_MODE'] == 'jwt':
+            revoke_signed(g.token_claims)
+            refresh_token = (request.get_json(silent=True) or {}).get(
+                'refresh_token')
+            claims = decode_token(refresh_token, 'refresh') \
+                if refresh_token else None
+            if claims is not None and claims['sub'] == g.current_user.id:
+                revoke_signed(claims)
+            return '', 204
         g.current_user.revoke_token()
         db.session.commit()
         return '', 204
+
+
+class TokenRefresh(Resource):
+    def post(self):
+        """Exchange a refresh token for a new access and refresh token."""
+        if current_app.config['TOKEN_MODE'] != 'jwt':
+            raise Unauthorized
+        refresh_token = (request.get_json(silent=True) or {}).get(
+            'refresh_token')
+        claims = decode_token(refresh_token, 'refresh') \
+            if refresh_token else None
+        if claims is None:
+            raise Unauthorized
+        revoke_signed(claims)
+        return signed_tokens_response(claims['sub'])
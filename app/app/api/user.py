@@ -1,10 +1,14 @@
-from flask import jsonify, request, url_for
+from flask import current_app, jsonify, request, url_for
 from flask_restful import Resource
 
 from app import db
+from app.conditional import cache_headers, make_etag, not_modified
 from .auth import token_auth
 from .permissions import CanDeleteProfile, CanUpdateProfile, allows
 from app.models import User
+from app.presence import buffered_last_seen
+from app.serializers import parse_fields, parse_ids
+from app.suggest import suggest_usernames
 
 from .errors import exceptions
 
@@ -19,7 +23,16 @@ class UserDetail(Resource):
     }
 
     def get(self, user_id):
-        return jsonify(User.query.get_or_404(user_id).to_dict())
+        fields = parse_fields(request.args.get('fields'))
+        serializer = User.serializer(only=fields)
+        user = User.query.with_entities(User.version, *serializer.columns). \
+            filter(User.id == user_id).first_or_404()
+        last_seen = buffered_last_seen([user.id]).get(user.id) \
+            if fields is None or 'last_seen' in fields else None
+        etag = make_etag('user', user.id, user.version, fields, last_seen)
+        response = not_modified(etag) or \
+            jsonify(serializer.serialize([user])[0])
+        return cache_headers(response, etag)
 
     def put(self, user_id):
         user = User.query.get_or_404(user_id)
@@ -47,10 +60,19 @@ class UserList(Resource):
     }
 
     def get(self):
+        if 'ids' in request.args:
+            return jsonify(User.to_batch_dict(
+                User.query, parse_ids(request.args['ids']),
+                fields=parse_fields(request.args.get('fields'))))
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 100)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        total = request.args.get('total', 'exact')
+        fields = parse_fields(request.args.get('fields'))
         data = User.to_collection_dict(
-            User.query, page, per_page, 'api.user_list')
+            User.query, page, per_page, 'api.user_list', after=after,
+            before=before, total=total, fields=fields)
         return jsonify(data)
 
     def post(self):
@@ -72,6 +94,23 @@ class UserList(Resource):
         return response
 
 
+class UserSuggest(Resource):
+    method_decorators = {
+        'get': [token_auth.login_required],
+    }
+
+    def get(self):
+        """Return the users whose username starts with the `q` prefix."""
+        default = current_app.config['USERNAME_SUGGEST_LIMIT']
+        limit = max(min(request.args.get('limit', default, type=int),
+                        default * 2), 1)
+        pairs = suggest_usernames(request.args.get('q', ''), limit)
+        return jsonify({'items': [
+            {'id': user_id, 'username': username,
+             '_links': {'self': url_for('api.user_detail', user_id=user_id)}}
+            for user_id, username in pairs]})
+
+
 def is_valid_data(data):
     return not ('username' not in data or
                 'email' not in data or
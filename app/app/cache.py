@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+_caches = {}
+_listener = {'pid': None}
+_listener_lock = threading.Lock()
+
+
+class LocalCache(object):
+    """A thread safe, size bounded LRU mapping of one process.
+
+    Entries expire `ttl` seconds after they are set, which bounds how long a
+    process can serve a value whose invalidation message it missed.
+    """
+
+    def __init__(self, name, maxsize=10000):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def invalidate(cache, keys):
+    """Drop keys from a local cache in this and every other process."""
+    if not keys:
+        return
+    for key in keys:
+        cache.delete(key)
+    try:
+        current_app.redis.publish(INVALIDATION_CHANNEL,
+                                  json.dumps([cache.name, list(keys)]))
+    except RedisError:
+        current_app.logger.warning('Cache invalidation publish failed',
+                                   exc_info=True)
+
+
+def invalidate_all(cache):
+    """Empty a local cache in this and every other process."""
+    cache.clear()
+    try:
+        current_app.redis.publish(INVALIDATION_CHANNEL,
+                                  json.dumps([cache.name, None]))
+    except RedisError:
+        current_app.logger.warning('Cache invalidation publish failed',
+                                   exc_info=True)
+
+
+def _listen(redis):
+    while True:
+        try:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Entries set while the subscription was down may be stale.
+            for cache in _caches.values():
+                cache.clear()
+            for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                name, keys = json.loads(message['data'].decode('utf-8'))
+                cache = _caches.get(name)
+                if cache is None:
+                    continue
+                if keys is None:
+                    cache.clear()
+                for key in keys or ():
+                    cache.delete(key)
+        except (RedisError, ValueError):
+            time.sleep(1)
+
+
+def start_listener():
+    """Subscribe this process to invalidation messages, once per process.
+
+    Called lazily from the caches, so that gunicorn workers forked from a
+    preloaded application each start their own subscriber thread.
+    """
+    if _listener['pid'] == os.getpid():
+        return
+    with _listener_lock:
+        if _listener['pid'] == os.getpid():
+            return
+        thread = threading.Thread(target=_listen,
+                                  args=(current_app.redis,),
+                                  name='cache-invalidation')
+        thread.daemon = True
+        thread.start()
+        _listener['pid'] = os.getpid()
@@ -1,4 +1,5 @@
 import os
+import time
 
 import click
 
@@ -33,3 +34,167 @@ def register(app):
         """Compile all languages."""
         if os.system('pybabel compile -d app/translations'):
             raise RuntimeError('compile command failed')
+
+    @app.cli.group()
+    def counters():
+        """Denormalized counter commands."""
+        pass
+
+    @counters.command()
+    def repair():
+        """Recompute user post and follower counters."""
+        from app.models import User
+        for name, count in sorted(User.repair_counters().items()):
+            click.echo('{}: {} rows repaired'.format(name, count))
+
+    @app.cli.group()
+    def suggest():
+        """Username suggestion commands."""
+        pass
+
+    @suggest.command()
+    def rebuild():
+        """Rebuild the username prefix index from the user table."""
+        from app.models import User
+        click.echo('{} usernames indexed'.format(User.rebuild_suggestions()))
+
+    @app.cli.group()
+    def messages():
+        """Private message commands."""
+        pass
+
+    @messages.command()
+    @click.option('--loop', is_flag=True,
+                  help='Reconcile every UNREAD_RECONCILE_INTERVAL seconds.')
+    def reconcile(loop):
+        """Correct the unread message counters from the message table."""
+        from redis.exceptions import RedisError
+        from sqlalchemy.exc import SQLAlchemyError
+        from app import db
+        from app.models import User
+        while True:
+            try:
+                checked, wrong = User.reconcile_unread()
+                click.echo('{} counters checked, {} corrected'.format(
+                    checked, wrong))
+            except (RedisError, SQLAlchemyError) as e:
+                db.session.rollback()
+                if not loop:
+                    raise
+                click.echo('reconcile failed: {}'.format(e), err=True)
+            if not loop:
+                break
+            time.sleep(app.config['UNREAD_RECONCILE_INTERVAL'])
+
+    @app.cli.group()
+    def presence():
+        """User presence commands."""
+        pass
+
+    @presence.command()
+    @click.option('--loop', is_flag=True,
+                  help='Flush every LAST_SEEN_FLUSH_INTERVAL seconds.')
+    def flush(loop):
+        """Write buffered last_seen times to the database."""
+        from redis.exceptions import RedisError
+        from sqlalchemy.exc import SQLAlchemyError
+        from app.models import User
+        while True:
+            try:
+                click.echo('{} users updated'.format(User.flush_last_seen()))
+            except (RedisError, SQLAlchemyError) as e:
+                if not loop:
+                    raise
+                click.echo('flush failed: {}'.format(e), err=True)
+            if not loop:
+                break
+            time.sleep(app.config['LAST_SEEN_FLUSH_INTERVAL'])
+
+    @app.cli.group()
+    def notifications():
+        """Notification store commands."""
+        pass
+
+    @notifications.command()
+    @click.option('--loop', is_flag=True,
+                  help='Keep saving every NOTIFICATION_PERSIST_INTERVAL '
+                       'seconds.')
+    def persist(loop):
+        """Save notifications from Redis to the notification table."""
+        from redis.exceptions import RedisError
+        from sqlalchemy.exc import SQLAlchemyError
+        from app.models import Notification
+        while True:
+            try:
+                saved = Notification.persist()
+                while saved:
+                    click.echo('{} users saved'.format(saved))
+                    saved = Notification.persist()
+            except (RedisError, SQLAlchemyError) as e:
+                if not loop:
+                    raise
+                click.echo('persist failed: {}'.format(e), err=True)
+            if not loop:
+                break
+            time.sleep(app.config['NOTIFICATION_PERSIST_INTERVAL'])
+
+    @app.cli.group()
+    def search():
+        """Search index commands."""
+        pass
+
+    @search.command()
+    @click.option('--loop', is_flag=True,
+                  help='Keep delivering changes as they are queued.')
+    def drain(loop):
+        """Deliver queued search index changes to Elasticsearch."""
+        from elasticsearch.exceptions import ElasticsearchException
+        from redis.exceptions import RedisError
+        from sqlalchemy.exc import SQLAlchemyError
+        from app import db
+        from app.models import SearchOutbox
+        while True:
+            try:
+                delivered, failed = SearchOutbox.drain(
+                    app.config['SEARCH_OUTBOX_BATCH'])
+                if delivered or failed:
+                    click.echo('{} delivered, {} failed'.format(delivered,
+                                                                failed))
+            except (ElasticsearchException, RedisError, SQLAlchemyError) as e:
+                db.session.rollback()
+                if not loop:
+                    raise
+                click.echo('drain failed: {}'.format(e), err=True)
+                delivered = failed = 0
+            if not loop:
+                break
+            if delivered + failed < app.config['SEARCH_OUTBOX_BATCH']:
+                time.sleep(app.config['SEARCH_OUTBOX_POLL_INTERVAL'])
+
+    @search.command()
+    @click.argument('model', default='post')
+    @click.option('--workers', type=int, default=None,
+                  help='Indexing processes, one per CPU by default.')
+    @click.option('--chunk-size', type=int, default=1000,
+                  help='Documents per _bulk request.')
+    @click.option('--checkpoint', default=None,
+                  help='Progress file, .reindex-MODEL.json by default.')
+    @click.option('--keep-old', is_flag=True,
+                  help='Keep the previous index after the switch.')
+    def reindex(model, workers, chunk_size, checkpoint, keep_old):
+        """Rebuild a search index.
+
+        With Elasticsearch the index is built next to the live one and its
+        alias is switched to it when done.
+        """
+        from app.models import SearchableMixin
+        models = {cls.__tablename__: cls
+                  for cls in SearchableMixin.__subclasses__()}
+        if model not in models:
+            raise click.BadParameter('one of ' + ', '.join(sorted(models)))
+        if app.search_backend is None:
+            raise click.ClickException('no search backend is configured')
+        models[model].reindex(
+            workers=workers, chunk_size=chunk_size,
+            checkpoint=checkpoint or '.reindex-{}.json'.format(model),
+            keep_old=keep_old, echo=click.echo)
@@ -0,0 +1,47 @@
+import hashlib
+
+from flask import current_app, request
+
+from app.pagination import page_query
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def collection_etag(owner, query, per_page, page=1, after=None, before=None,
+                    params=(), overlay=None):
+    """Build the ETag of a collection page from its row ids and versions.
+
+    `owner` is the row whose version changes with the collection totals,
+    `params` are the other request arguments that shape the response.
+    `overlay(ids)` returns the values of rows that are served without
+    changing their version, like last_seen times buffered in Redis.
+    """
+    model = query.column_descriptions[0]['entity']
+    rows = page_query(query.with_entities(model.id, model.version),
+                      per_page, page, after, before).all()
+    overlaid = sorted(overlay([row.id for row in rows]).items()) \
+        if overlay is not None and rows else None
+    return make_etag(model.__tablename__, owner.id, owner.version,
+                     [tuple(row) for row in rows], per_page, page, after,
+                     before, params, overlaid)
+
+
+def not_modified(etag):
+    """Return a 304 response when the client already holds `etag`."""
+    if etag not in request.if_none_match:
+        return None
+    return cache_headers(current_app.response_class(status=304), etag)
+
+
+def cache_headers(response, etag):
+    """Set the ETag and Cache-Control headers of a response.
+
+    Responses depend on the authenticated user and are never stored by
+    shared caches, clients have to revalidate them with If-None-Match.
+    """
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
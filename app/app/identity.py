@@ -0,0 +1,111 @@
+import json
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app import db
+from app.cache import LocalCache, invalidate, invalidate_all, start_listener
+
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_local_users = LocalCache('user')
+
+
+def _enabled():
+    return current_app.config['USER_CACHE']
+
+
+def _encode(values):
+    return json.dumps({name: value.strftime(DATETIME_FORMAT)
+                       if isinstance(value, datetime) else value
+                       for name, value in values.items()})
+
+
+def _decode(data, columns):
+    values = json.loads(data)
+    for column in columns:
+        value = values.get(column.name)
+        if value is not None and isinstance(column.type, db.DateTime):
+            values[column.name] = datetime.strptime(value, DATETIME_FORMAT)
+    return values
+
+
+def _get(local_key, redis_key, decode):
+    cached = _local_users.get(local_key)
+    if cached is not None:
+        return cached
+    try:
+        data = current_app.redis.get(redis_key)
+    except RedisError:
+        return None
+    if data is None:
+        return None
+    cached = decode(data.decode('utf-8'))
+    _local_users.set(local_key, cached,
+                     current_app.config['USER_CACHE_LOCAL_TTL'])
+    return cached
+
+
+def get_cached_user(user_id, columns):
+    """Return the cached column values of a user, or None on a miss."""
+    if not _enabled():
+        return None
+    start_listener()
+    return _get('id:{}'.format(user_id), 'user:{}'.format(user_id),
+                lambda data: _decode(data, columns))
+
+
+def get_cached_user_id(username):
+    if not _enabled():
+        return None
+    start_listener()
+    return _get('name:' + username, 'user:name:' + username, int)
+
+
+def cache_user(values):
+    """Store the column values of a user, addressable by id and username."""
+    if not _enabled():
+        return
+    local_ttl = current_app.config['USER_CACHE_LOCAL_TTL']
+    _local_users.set('id:{}'.format(values['id']), values, local_ttl)
+    _local_users.set('name:' + values['username'], values['id'], local_ttl)
+    ttl = current_app.config['USER_CACHE_TTL']
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        pipe.set('user:{}'.format(values['id']), _encode(values), ex=ttl)
+        pipe.set('user:name:' + values['username'], values['id'], ex=ttl)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def invalidate_users(user_ids, usernames=()):
+    """Drop users from Redis and from the local cache of every worker."""
+    if not _enabled() or not (user_ids or usernames):
+        return
+    local_keys = ['id:{}'.format(id) for id in user_ids] + \
+        ['name:' + name for name in usernames]
+    try:
+        current_app.redis.delete(
+            *['user:{}'.format(id) for id in user_ids] +
+            ['user:name:' + name for name in usernames])
+    except RedisError:
+        current_app.logger.warning('User cache invalidation failed',
+                                   exc_info=True)
+    invalidate(_local_users, local_keys)
+
+
+def clear_user_cache():
+    """Drop every cached user, after bulk updates of the user table."""
+    if not _enabled():
+        return
+    try:
+        keys = list(current_app.redis.scan_iter('user:*', count=1000))
+        for i in range(0, len(keys), 1000):
+            current_app.redis.delete(*keys[i:i + 1000])
+    except RedisError:
+        current_app.logger.warning('User cache invalidation failed',
+                                   exc_info=True)
+    invalidate_all(_local_users)
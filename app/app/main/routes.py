@@ -1,22 +1,30 @@
 from datetime import datetime
 
-from flask import render_template, flash, redirect, url_for, request, g, jsonify, current_app
+from flask import render_template, flash, redirect, url_for, request, g, jsonify, current_app, abort, \
+    Response, stream_with_context
 from flask_babel import get_locale, _
 from flask_login import current_user, login_required
 from guess_language import guess_language
 
 from app import db
+from app.conditional import cache_headers, make_etag, not_modified
 from app.main import bp
 from app.main.forms import EditProfileForm, PostForm, SearchForm, MessageForm
 from app.models import User, Post, Message, Notification
+from app.notifications import stream_notifications
+from app.pagination import paginate
+from app.presence import record_last_seen
+from app.suggest import suggest_usernames
 from app.translate import translate
 
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        now = datetime.utcnow()
+        if not record_last_seen(current_user.id, now):
+            current_user.last_seen = now
+            db.session.commit()
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
@@ -36,9 +44,10 @@ def index():
         flash(_('Your post is now live!'))
         return redirect(url_for('main.index'))
     page = request.args.get('page', 1, type=int)
-    posts = current_user.followed_posts().paginate(page, current_app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.index', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) if posts.has_prev else None
+    posts = current_user.timeline(current_app.config['POSTS_PER_PAGE'], page,
+                                  request.args.get('after'), request.args.get('before'))
+    next_url = url_for('main.index', after=posts.next_cursor) if posts.has_next else None
+    prev_url = url_for('main.index', before=posts.prev_cursor) if posts.has_prev else None
     return render_template('index.html',
                            title=_('Home'),
                            form=form,
@@ -50,11 +59,12 @@ def index():
 @bp.route('/user/<username>')
 @login_required
 def user(username):
-    user = User.query.filter_by(username=username).first_or_404()
+    user = User.load_by_username(username) or abort(404)
     page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(page, current_app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.user', username=user.username, page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.user', username=user.username, page=posts.prev_num) if posts.has_prev else None
+    posts = paginate(user.posts, current_app.config['POSTS_PER_PAGE'], page,
+                     request.args.get('after'), request.args.get('before'))
+    next_url = url_for('main.user', username=user.username, after=posts.next_cursor) if posts.has_next else None
+    prev_url = url_for('main.user', username=user.username, before=posts.prev_cursor) if posts.has_prev else None
     return render_template('user.html', user=user, posts=posts.items, next_url=next_url, prev_url=prev_url)
 
 
@@ -77,7 +87,7 @@ def edit_profile():
 @bp.route('/follow/<username>')
 @login_required
 def follow(username):
-    user = User.query.filter_by(username=username).first()
+    user = User.load_by_username(username)
     if user is None:
         flash(_('User %(username)s not found.', username=username))
         return redirect(url_for('main.index'))
@@ -93,7 +103,7 @@ def follow(username):
 @bp.route('/unfollow/<username>')
 @login_required
 def unfollow(username):
-    user = User.query.filter_by(username=username).first()
+    user = User.load_by_username(username)
     if user is None:
         flash(_('User %(username)s not found.', username=username))
         return redirect(url_for('main.index'))
@@ -110,9 +120,10 @@ def unfollow(username):
 @login_required
 def explore():
     page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate(page, current_app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.explore', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) if posts.has_prev else None
+    posts = paginate(Post.query, current_app.config['POSTS_PER_PAGE'], page,
+                     request.args.get('after'), request.args.get('before'))
+    next_url = url_for('main.explore', after=posts.next_cursor) if posts.has_next else None
+    prev_url = url_for('main.explore', before=posts.prev_cursor) if posts.has_prev else None
     return render_template('index.html', title=_('Explore'), posts=posts.items, next_url=next_url, prev_url=prev_url)
 
 
@@ -129,32 +140,60 @@ def translate_text():
 def search():
     if not g.search_form.validate():
         return redirect(url_for('main.explore'))
+    q = g.search_form.q.data
+    per_page = current_app.config['POSTS_PER_PAGE']
     page = request.args.get('page', 1, type=int)
-    posts, total = Post.search(g.search_form.q.data, page, current_app.config['POSTS_PER_PAGE'])
-    next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
-        if total > page * current_app.config['POSTS_PER_PAGE'] else None
-    prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
-        if page > 1 else None
+    after = request.args.get('after')
+    if page > 1 and after is None:
+        # Pages are only reached through the cursor of the previous one.
+        after = Post.search_cursor(q, per_page, page)
+        if after is None:
+            return redirect(url_for('main.search', q=q))
+    posts, cursor = Post.search(q, per_page, page, after)
+    next_url = url_for('main.search', q=q, page=page + 1, after=cursor) \
+        if cursor else None
+    prev_url = None
+    if page > 1:
+        # Without the cursor of the previous page, go back to the first one.
+        after = Post.search_cursor(q, per_page, page - 1)
+        prev_url = url_for('main.search', q=q, page=page - 1, after=after) \
+            if after or page == 2 else url_for('main.search', q=q)
     return render_template('search.html', title=_('Search'), posts=posts, next_url=next_url, prev_url=prev_url)
 
 
+@bp.route('/suggest/users')
+@login_required
+def suggest_users():
+    pairs = suggest_usernames(request.args.get('q', ''),
+                              current_app.config['USERNAME_SUGGEST_LIMIT'])
+    return jsonify({'items': [
+        {'username': username, 'url': url_for('main.user', username=username)}
+        for _, username in pairs]})
+
+
 @bp.route('/user/<username>/popup')
 @login_required
 def user_popup(username):
-    user = User.query.filter_by(username=username).first_or_404()
-    return render_template('user_popup.html', user=user)
+    user = User.load_by_username(username) or abort(404)
+    etag = make_etag('user_popup', user.id, user.version,
+                     user.get_last_seen(), current_user.id,
+                     current_user.version, g.locale)
+    response = not_modified(etag) or \
+        current_app.make_response(render_template('user_popup.html', user=user))
+    return cache_headers(response, etag)
 
 
 @bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
 @login_required
 def send_message(recipient):
-    user = User.query.filter_by(username=recipient).first_or_404()
+    user = User.load_by_username(recipient) or abort(404)
     form = MessageForm()
     if form.validate_on_submit():
         msg = Message(author=current_user, recipient=user, body=form.message.data)
-        user.add_notification('unread_message_count', user.new_messages())
         db.session.add(msg)
         db.session.commit()
+        user.add_notification('unread_message_count', user.unread_message_count())
+        db.session.commit()
         flash(_('Your message has been sent.'))
         return redirect(url_for('main.user', username=recipient))
     return render_template('send_message.html', title=_('Send Message'), form=form, recipient=recipient)
@@ -167,10 +206,10 @@ def messages():
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
     page = request.args.get('page', 1, type=int)
-    messages = current_user.messages_received.order_by(Message.timestamp.desc()).paginate(
-        page, current_app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.messages', page=messages.next_num) if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) if messages.has_prev else None
+    messages = paginate(current_user.messages_received, current_app.config['POSTS_PER_PAGE'], page,
+                        request.args.get('after'), request.args.get('before'))
+    next_url = url_for('main.messages', after=messages.next_cursor) if messages.has_next else None
+    prev_url = url_for('main.messages', before=messages.prev_cursor) if messages.has_prev else None
     return render_template('messages.html', messages=messages.items, next_url=next_url, prev_url=prev_url)
 
 
@@ -178,9 +217,39 @@ def messages():
 @login_required
 def notifications():
     since = request.args.get('since', 0.0, type=float)
-    notifications = current_user.notifications.filter(
-        Notification.timestamp > since).order_by(Notification.timestamp.asc())
-    return jsonify([{'name': n.name, 'data': n.get_data(), 'timestamp': n.timestamp} for n in notifications])
+    notifications = Notification.since(current_user.id, since)
+    etag = make_etag('notifications', current_user.id, since,
+                     [(n.name, n.timestamp) for n in notifications])
+    response = not_modified(etag)
+    if response is None:
+        response = jsonify([{'name': n.name, 'data': n.get_data(), 'timestamp': n.timestamp}
+                            for n in notifications])
+    return cache_headers(response, etag)
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    if not current_app.config['NOTIFICATION_STREAM']:
+        abort(404)
+    try:
+        since = float(request.headers.get('Last-Event-ID') or
+                      request.args.get('since') or 0.0)
+    except ValueError:
+        since = 0.0
+    user_id = current_user.id
+
+    def backlog(since):
+        items = [{'name': n.name, 'data': n.get_data(), 'timestamp': n.timestamp}
+                 for n in Notification.since(user_id, since)]
+        # Do not hold a database connection while the stream is idle.
+        db.session.remove()
+        return items
+
+    db.session.remove()
+    return Response(stream_with_context(stream_notifications(user_id, since, backlog)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @bp.route('/export_posts')
@@ -1,5 +1,6 @@
 import base64
 import json
+import math
 import os
 from datetime import datetime, timedelta
 from hashlib import md5
@@ -10,15 +11,48 @@ import redis
 import rq
 from flask_restful import current_app, url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, get_history, \
+    set_committed_value
+from sqlalchemy.orm.util import identity_key
 
 from app import db, login
-from app.search import add_to_index, query_index, remove_from_index
+from app.identity import DATETIME_FORMAT, cache_user, clear_user_cache, \
+    get_cached_user, get_cached_user_id, invalidate_users
+from app.notifications import mark_dirty_users, publish_notifications, \
+    read_notifications, store_notifications, stored_items, take_dirty_users
+from app.pagination import Page, count, decode_cursor, keyset, paginate
+from app.passwords import hash_password, needs_rehash, verify_password
+from app.presence import buffered_last_seen, restore_last_seen, \
+    take_last_seen
+from app.search import bulk_index, bump_generations, document, \
+    is_transactional, page_cursor, query_index, reindex_model
+from app.serializers import Serializer, UrlTemplate
+from app.suggest import rebuild_suggestions, update_suggestions
+from app.tokens import cache_token, get_cached_token, invalidate_tokens
+from app.timeline import add_to_timelines, cache_timeline, get_celebrities, \
+    read_timeline, remove_from_timelines, score, set_celebrity
+from app.unread import correct_unread, counted_users, fill_unread, \
+    get_unread, update_unread
+
+
+def email_digest(email):
+    return md5(email.lower().encode('utf-8')).hexdigest()
+
+
+def gravatar_url(digest, size):
+    return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
+        digest, size)
+
+
+def avatar_url(email, size):
+    return gravatar_url(email_digest(email), size)
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return User.load(int(id))
 
 
 followers = db.Table(
@@ -30,67 +64,137 @@ followers = db.Table(
 
 class PaginatedAPIMixin(object):
     @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-        resources = query.paginate(page, per_page, False)
+    def to_collection_dict(query, page, per_page, endpoint, after=None,
+                           before=None, total='exact', fields=None,
+                           expand=None, **kwargs):
+        serializer = query.column_descriptions[0]['entity'].serializer(
+            only=fields, expand=expand)
+        total_items = count(query, total)
+        resources = paginate(query.with_entities(*serializer.columns),
+                             per_page, page, after, before)
+        if after is not None or before is not None:
+            page = None
+        kwargs.update(total=total if total != 'exact' else None,
+                      fields=','.join(fields) if fields else None,
+                      expand=','.join(expand) if expand else None)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': serializer.serialize(resources.items),
             '_meta': {
                 'page': page,
                 'per_page': per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
+                'total_pages': int(math.ceil(total_items / float(per_page)))
+                if total_items is not None else None,
+                'total_items': total_items
             },
             '_links': {
                 'self': url_for(endpoint, page=page, per_page=per_page,
-                                **kwargs),
-                'next': url_for(endpoint, page=page + 1, per_page=per_page,
-                                **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, page=page - 1, per_page=per_page,
-                                **kwargs) if resources.has_prev else None
+                                after=after, before=before, **kwargs),
+                'next': url_for(endpoint, per_page=per_page,
+                                after=resources.next_cursor, **kwargs)
+                if resources.has_next else None,
+                'prev': url_for(endpoint, per_page=per_page,
+                                before=resources.prev_cursor, **kwargs)
+                if resources.has_prev else None
             }
         }
+        if total == 'estimate':
+            data['_meta']['total_estimated'] = True
         return data
 
+    @staticmethod
+    def to_batch_dict(query, ids, fields=None, expand=None):
+        """Serialize the rows of `query` with the given ids, in that order.
+
+        Rows are read with a single IN query, ids that were not found are
+        listed in _meta.missing.
+        """
+        model = query.column_descriptions[0]['entity']
+        serializer = model.serializer(only=fields, expand=expand)
+        rows = query.with_entities(*serializer.columns).filter(
+            model.id.in_(ids)).all()
+        items = dict(zip([row.id for row in rows],
+                         serializer.serialize(rows)))
+        return {
+            'items': [items[id] for id in ids if id in items],
+            '_meta': {
+                'requested': len(ids),
+                'missing': [id for id in ids if id not in items]
+            }
+        }
+
 
 class SearchableMixin(object):
     @classmethod
-    def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return cls.query.filter_by(id=0), 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        return cls.query.filter(cls.id.in_(ids)).order_by(
-            db.case(when, value=cls.id)), total
+    def search(cls, expression, per_page, page=1, after=None):
+        """Return a page of matching objects, and the next page cursor.
+
+        Results are built from the source stored in the index when possible,
+        the database is only queried for hits without a usable source.
+        """
+        hits, cursor = query_index(cls.__tablename__, expression,
+                                   cls.__searchable__, per_page, page, after)
+        results = {}
+        for id, source in hits:
+            result = cls.from_source(id, source) if source else None
+            if result is not None:
+                results[id] = result
+        stale = [id for id, _ in hits if id not in results]
+        if stale:
+            results.update((obj.id, obj) for obj in
+                           cls.indexing_query().filter(cls.id.in_(stale)))
+        return [results[id] for id, _ in hits if id in results], cursor
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': [obj for obj in session.new if isinstance(obj, cls)],
-            'update': [obj for obj in session.dirty if isinstance(obj, cls)],
-            'delete': [obj for obj in session.deleted if isinstance(obj, cls)]
-        }
+    def search_cursor(cls, expression, per_page, page):
+        return page_cursor(cls.__tablename__, expression, per_page, page)
+
+    @classmethod
+    def indexing_query(cls):
+        """Return the query loading objects to build their documents."""
+        return cls.query
 
     @classmethod
-    def after_commit(cls, session):
-        for obj in session._changes['add']:
-            add_to_index(cls.__tablename__, obj)
-        for obj in session._changes['update']:
-            add_to_index(cls.__tablename__, obj)
-        for obj in session._changes['delete']:
-            remove_from_index(cls.__tablename__, obj)
-        session._changes = None
+    def from_source(cls, id, source):
+        """Build a search result from a stored source, None if unusable."""
+        return None
+
+    def search_source(self):
+        return {}
 
     @classmethod
-    def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+    def after_flush(cls, session, flush_context):
+        """Index the flushed objects, or queue them in the search outbox.
+
+        Either way the change is written in the transaction of the flush, so
+        an index update is neither lost nor sent for a change rolled back.
+        """
+        changed = [obj for obj in session.new if isinstance(obj, cls)]
+        changed += [obj for obj in session.dirty if isinstance(obj, cls) and
+                    any(get_history(obj, field).has_changes()
+                        for field in cls.__searchable__)]
+        deleted = [obj for obj in session.deleted if isinstance(obj, cls)]
+        if is_transactional():
+            bulk_index([(cls.__tablename__, obj.id, None, document(obj))
+                        for obj in changed] +
+                       [(cls.__tablename__, obj.id, None, None)
+                        for obj in deleted])
+        else:
+            SearchOutbox.enqueue(session, cls.__tablename__,
+                                 [obj.id for obj in changed + deleted])
+
+    @classmethod
+    def reindex(cls, **options):
+        """Rebuild the search index of the model with the search backend."""
+        reindex_model(cls, **options)
 
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
+    __keyset__ = ['id']
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(64), index=True, unique=True)
+    # The previous username is loaded when it changes, so that the caches
+    # and the suggestion index keyed by it can drop it.
+    username = db.column_property(
+        db.Column(db.String(64), index=True, unique=True), active_history=True)
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
@@ -117,10 +221,66 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     tasks = db.relationship('Task', backref='user', lazy='dynamic')
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
+    post_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    follower_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    followed_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     def __repr__(self):
         return '<User {}>'.format(self.username)
 
+    # Secrets are not copied to the identity cache, they are loaded from the
+    # database when needed.
+    __uncached__ = ['password_hash', 'token']
+
+    @classmethod
+    def cached_columns(cls):
+        return [column for column in cls.__table__.columns
+                if column.name not in cls.__uncached__]
+
+    @staticmethod
+    def load(id):
+        """Return a user by id, read through the identity cache."""
+        user = db.session.identity_map.get(identity_key(User, id))
+        if user is not None:
+            return user
+        values = get_cached_user(id, User.cached_columns())
+        if values is not None:
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        user = User.query.get(id)
+        if user is not None:
+            user.cache()
+        return user
+
+    @staticmethod
+    def load_by_username(username):
+        id = get_cached_user_id(username)
+        if id is not None:
+            user = User.load(id)
+            if user is not None and user.username == username:
+                return user
+        user = User.query.filter_by(username=username).first()
+        if user is not None:
+            user.cache()
+        return user
+
+    def cache(self):
+        """Copy the columns of the user to the identity cache.
+
+        Users with changes that are not committed yet are left out.
+        """
+        if self.id in db.session.info.get('changed_users', {}) or \
+                db.session.is_modified(self):
+            return
+        cache_user({column.name: getattr(self, column.name)
+                    for column in User.cached_columns()})
+
     def get_token(self, expires_in=3600):
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
@@ -134,15 +294,22 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify a password, upgrading its hash to the configured method.
+
+        The caller commits the session to save an upgraded hash.
+        """
+        if not self.password_hash or \
+                not verify_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
-            digest, size)
+        return avatar_url(self.email, size)
 
     def follow(self, user):
         if not self.is_following(user):
@@ -164,6 +331,100 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         own = Post.query.filter_by(user_id=self.id)
         return followed.union(own).order_by(Post.timestamp.desc())
 
+    def timeline(self, per_page, page=1, after=None, before=None):
+        """Return a Page of followed_posts().
+
+        The page is read from the cached timeline and merged with the posts
+        of followed users that are too popular to be fanned out. Pages that
+        are not covered by the cache, and offset pages requested with page=,
+        are read from the database.
+        """
+        if after is None and before is None and page > 1:
+            return paginate(self.followed_posts(), per_page, page)
+        limit = per_page + 1
+        cached = read_timeline(
+            self.id, limit,
+            after=decode_cursor(after, Post) if after is not None else None,
+            before=decode_cursor(before, Post) if before is not None else None)
+        if cached is None and after is None and before is None and \
+                current_app.config['TIMELINE_CACHE']:
+            cached = self.rebuild_timeline(limit)
+        if cached is None or (len(cached[0]) < limit and not cached[1]):
+            return paginate(self.followed_posts(), per_page,
+                            after=after, before=before)
+        entries = dict(cached[0])
+        celebrities = self.followed_celebrities()
+        if celebrities:
+            pulled = keyset(db.session.query(Post.id, Post.timestamp).filter(
+                Post.user_id.in_(celebrities)), after, before).limit(limit)
+            entries.update((id, score(timestamp)) for id, timestamp in pulled)
+        entries = sorted(entries.items(), key=lambda e: (e[1], e[0]),
+                         reverse=before is None)
+        ids = [id for id, _ in entries[:per_page]]
+        has_more = len(entries) > per_page
+        if before is not None:
+            ids.reverse()
+        posts = {post.id: post for post in Post.query.options(
+            db.joinedload('author')).filter(Post.id.in_(ids))} if ids else {}
+        posts = [posts[id] for id in ids if id in posts]
+        if before is not None:
+            return Page(posts, True, has_more, Post.__keyset__)
+        return Page(posts, has_more, after is not None, Post.__keyset__)
+
+    def rebuild_timeline(self, count):
+        """Cache the newest TIMELINE_LENGTH posts of followed_posts()."""
+        length = current_app.config['TIMELINE_LENGTH']
+        followed = db.select([followers.c.followed_id]).where(
+            followers.c.follower_id == self.id)
+        entries = db.session.query(Post.id, Post.timestamp).filter(
+            db.or_(Post.user_id == self.id, Post.user_id.in_(followed))). \
+            order_by(Post.timestamp.desc(), Post.id.desc()). \
+            limit(length + 1).all()
+        complete = len(entries) <= length
+        cache_timeline(self.id, entries[:length], complete)
+        return [(id, score(timestamp)) for id, timestamp in
+                entries[:min(count, length)]], complete
+
+    def followed_celebrities(self):
+        celebrities = get_celebrities()
+        if not celebrities:
+            return []
+        return [id for id, in db.session.query(followers.c.followed_id).filter(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id.in_(celebrities))]
+
+    def get_last_seen(self):
+        """Return last_seen, including an update not flushed from Redis."""
+        return buffered_last_seen([self.id]).get(self.id) or self.last_seen
+
+    @staticmethod
+    def flush_last_seen():
+        """Write the last_seen times buffered in Redis to the user table.
+
+        Returns the number of users updated.
+        """
+        last_seen = take_last_seen()
+        if not last_seen:
+            return 0
+        user = User.__table__
+        try:
+            db.session.execute(
+                user.update().where(db.and_(
+                    user.c.id == db.bindparam('_id'),
+                    db.or_(user.c.last_seen.is_(None),
+                           user.c.last_seen < db.bindparam('_last_seen')))).
+                values(last_seen=db.bindparam('_last_seen'),
+                       version=user.c.version + 1),
+                [{'_id': id, '_last_seen': when}
+                 for id, when in last_seen.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            restore_last_seen(last_seen)
+            raise
+        invalidate_users(list(last_seen))
+        return len(last_seen)
+
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
@@ -175,7 +436,46 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return Message.query.filter_by(recipient=self).filter(
             Message.timestamp > last_read_time).count()
 
+    def unread_message_count(self):
+        """Return new_messages() from the Redis counter when it is known."""
+        count = get_unread(self.id)
+        if count is None:
+            count = self.new_messages()
+            fill_unread(self.id, count)
+        return count
+
+    @staticmethod
+    def reconcile_unread(batch_size=1000):
+        """Correct the unread counters in Redis from the message table.
+
+        Returns the number of counters checked and of those that were wrong.
+        """
+        checked = wrong = 0
+        for user_ids in counted_users(batch_size):
+            counts = dict(db.session.query(
+                User.id, db.func.count(Message.id)).outerjoin(
+                Message, db.and_(
+                    Message.recipient_id == User.id,
+                    Message.timestamp > db.func.coalesce(
+                        User.last_message_read_time, datetime(1900, 1, 1)))). \
+                filter(User.id.in_(user_ids)).group_by(User.id))
+            db.session.commit()
+            checked += len(counts)
+            wrong += correct_unread(counts)
+        return checked, wrong
+
     def add_notification(self, name, data):
+        """Replace the notification of a name, once the session commits.
+
+        With NOTIFICATION_STORE it is saved to Redis after the commit instead
+        of replacing a row of the notification table.
+        """
+        if current_app.config['NOTIFICATION_STORE']:
+            n = Notification(name=name, payload_json=json.dumps(data),
+                             user_id=self.id, timestamp=time())
+            db.session.info.setdefault('new_notifications', []).append(
+                (n.user_id, n.name, n.payload_json, n.timestamp))
+            return n
         self.notifications.filter_by(name=name).delete()
         n = Notification(name=name, payload_json=json.dumps(data), user=self)
         db.session.add(n)
@@ -200,11 +500,11 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         data = {
             'id': self.id,
             'username': self.username,
-            'last_seen': self.last_seen.isoformat() + 'Z',
+            'last_seen': self.get_last_seen().isoformat() + 'Z',
             'about_me': self.about_me,
-            'post_count': self.posts.count(),
-            'follower_count': self.followers.count(),
-            'followed_count': self.followed.count(),
+            'post_count': self.post_count,
+            'follower_count': self.follower_count,
+            'followed_count': self.followed_count,
             '_links': {
                 'self': url_for('api.user_detail', user_id=self.id),
                 'followers': url_for('api.follower_list', user_id=self.id),
@@ -216,6 +516,51 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             data['email'] = self.email
         return data
 
+    @classmethod
+    def serializer(cls, include_email=False, only=None, expand=None):
+        """Return a Serializer producing the same output as to_dict().
+
+        `only` restricts the output to some fields, and the query to the
+        columns they need.
+        """
+        self_url = UrlTemplate('api.user_detail', user_id='id')
+        followers_url = UrlTemplate('api.follower_list', user_id='id')
+        followed_url = UrlTemplate('api.followed_list', user_id='id')
+        fields = [
+            ('id', ['id'], lambda row: row.id),
+            ('username', ['username'], lambda row: row.username),
+            ('last_seen', ['last_seen'],
+             lambda row: row.last_seen.isoformat() + 'Z'),
+            ('about_me', ['about_me'], lambda row: row.about_me),
+            ('post_count', ['post_count'], lambda row: row.post_count),
+            ('follower_count', ['follower_count'],
+             lambda row: row.follower_count),
+            ('followed_count', ['followed_count'],
+             lambda row: row.followed_count),
+            ('_links', ['id', 'email'], lambda row: {
+                'self': self_url(row),
+                'followers': followers_url(row),
+                'followed': followed_url(row),
+                'avatar': avatar_url(row.email, 128)
+            }),
+        ]
+        if include_email:
+            fields.append(('email', ['email'], lambda row: row.email))
+        overlays = {'last_seen': ('id', lambda ids: {
+            id: when.isoformat() + 'Z'
+            for id, when in buffered_last_seen(ids).items()})}
+        return Serializer(cls, fields, only=only, expand=expand,
+                          overlays=overlays)
+
+    @staticmethod
+    def load_many(ids, serializer=None):
+        """Return serialized users by id, read with a single IN query."""
+        serializer = serializer or User.serializer()
+        rows = User.query.with_entities(*serializer.columns).filter(
+            User.id.in_(ids))
+        rows = rows.all()
+        return dict(zip([row.id for row in rows], serializer.serialize(rows)))
+
     def from_dict(self, data, new_user=False):
         for field in ['username', 'email', 'about_me']:
             if field in data:
@@ -232,25 +577,149 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             return
         return User.query.get(id)
 
+    @staticmethod
+    def rebuild_suggestions():
+        """Rebuild the username suggestion index from the user table."""
+        return rebuild_suggestions(
+            db.session.query(User.id, User.username).order_by(
+                User.id).yield_per(5000))
+
+    @staticmethod
+    def repair_counters():
+        """Recompute the denormalized counters of every user.
+
+        Only rows that drifted are written. Returns the number of repaired
+        rows per counter.
+        """
+        user = User.__table__
+        counts = {
+            'post_count': db.select([db.func.count(Post.id)]).where(
+                Post.user_id == user.c.id),
+            'follower_count': db.select([db.func.count()]).where(
+                followers.c.followed_id == user.c.id),
+            'followed_count': db.select([db.func.count()]).where(
+                followers.c.follower_id == user.c.id),
+        }
+        repaired = {}
+        for name, count in counts.items():
+            count = count.as_scalar()
+            result = db.session.execute(user.update().where(
+                user.c[name] != count).values({name: count}))
+            repaired[name] = result.rowcount
+        db.session.commit()
+        if any(repaired.values()):
+            clear_user_cache()
+        return repaired
+
     @staticmethod
     def check_token(token):
+        cached = get_cached_token(token)
+        if cached is not None:
+            user_id, expiration = cached
+            if expiration < datetime.utcnow():
+                return None
+            return User.load(user_id)
         user = User.query.filter_by(token=token).first()
         if user is None or user.token_expiration < datetime.utcnow():
             return None
+        cache_token(token, user.id, user.token_expiration)
         return user
 
 
+class IndexedAuthor(object):
+    """The author of a search result, as stored in the search index."""
+
+    def __init__(self, id, username, digest):
+        self.id = id
+        self.username = username
+        self.digest = digest
+
+    def avatar(self, size):
+        return gravatar_url(self.digest, size)
+
+
+class IndexedPost(object):
+    """A post search result rendered from the search index."""
+
+    def __init__(self, id, source):
+        self.id = id
+        self.body = source['body']
+        self.timestamp = datetime.strptime(source['timestamp'],
+                                           DATETIME_FORMAT)
+        self.language = source['language']
+        self.user_id = source['user_id']
+        self.author = IndexedAuthor(source['user_id'], source['username'],
+                                    source['avatar'])
+
+
 class Post(PaginatedAPIMixin, SearchableMixin, db.Model):
     __searchable__ = ['body']
+    __keyset__ = ['timestamp', 'id']
+    __table_args__ = (
+        db.Index('ix_post_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_post_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     language = db.Column(db.String(5))
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
+    @classmethod
+    def indexing_query(cls):
+        return cls.query.options(db.joinedload(cls.author))
+
+    @classmethod
+    def from_source(cls, id, source):
+        try:
+            return IndexedPost(id, source)
+        except (KeyError, ValueError):
+            return None
+
+    def search_source(self):
+        # Posts created with a user_id have no author loaded when flushed.
+        author = self.author or User.load(self.user_id)
+        return {
+            'body': self.body,
+            'timestamp': self.timestamp.strftime(DATETIME_FORMAT),
+            'language': self.language,
+            'user_id': self.user_id,
+            'username': author.username,
+            'avatar': email_digest(author.email),
+        }
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        """Also update the documents of authors renamed in the flush."""
+        super(Post, cls).after_flush(session, flush_context)
+        if not current_app.config['SEARCH_STORE_SOURCE'] or \
+                current_app.search_backend is None:
+            return
+        authors = [user.id for user in session.dirty
+                   if isinstance(user, User) and
+                   (get_history(user, 'username').has_changes() or
+                    get_history(user, 'email').has_changes())]
+        if not authors:
+            return
+        query = session.query(cls).filter(cls.user_id.in_(authors))
+        if is_transactional():
+            chunk = []
+            for post in query.yield_per(1000):
+                chunk.append((cls.__tablename__, post.id, None,
+                              document(post)))
+                if len(chunk) == 1000:
+                    bulk_index(chunk)
+                    chunk = []
+            bulk_index(chunk)
+        else:
+            SearchOutbox.enqueue(session, cls.__tablename__,
+                                 [id for id, in query.with_entities(cls.id)])
+
     def from_dict(self, data):
         for field in ['body', 'user_id', 'language']:
             if field in data:
@@ -271,19 +740,205 @@ class Post(PaginatedAPIMixin, SearchableMixin, db.Model):
         }
         return data
 
+    @classmethod
+    def serializer(cls, only=None, expand=None):
+        """Return a Serializer producing the same output as to_dict().
+
+        `expand=['author']` embeds the authors of the serialized posts.
+        """
+        self_url = UrlTemplate('api.post_detail', user_id='user_id',
+                               post_id='id')
+        author_url = UrlTemplate('api.user_detail', user_id='user_id')
+        fields = [
+            ('id', ['id'], lambda row: row.id),
+            ('body', ['body'], lambda row: row.body),
+            ('timestamp', ['timestamp'],
+             lambda row: row.timestamp.isoformat() + 'Z'),
+            ('user_id', ['user_id'], lambda row: row.user_id),
+            ('language', ['language'], lambda row: row.language),
+            ('_links', ['id', 'user_id'], lambda row: {
+                'self': self_url(row),
+                'author': author_url(row),
+            }),
+        ]
+        expansions = {'author': ('user_id', User.load_many)}
+        return Serializer(cls, fields, expansions, only=only, expand=expand)
+
+    @classmethod
+    def create_many(cls, user, items):
+        """Insert posts of a user with one multi-row INSERT and commit.
+
+        `items` are dicts with the body and language of each post. The author
+        counters and the search outbox are updated in the same transaction,
+        the posts are then fanned out to the cached timelines. Returns the new
+        posts, detached from the session.
+        """
+        if not items:
+            return []
+        user_id = user.id
+        now = datetime.utcnow()
+        rows = [{'body': item['body'], 'language': item.get('language'),
+                 'user_id': user_id, 'timestamp': now, 'version': 1}
+                for item in items]
+        table = cls.__table__
+        if db.session.connection().dialect.name == 'postgresql':
+            ids = [id for id, in db.session.execute(
+                table.insert().values(rows).returning(table.c.id))]
+        else:
+            db.session.bulk_insert_mappings(cls, rows, return_defaults=True)
+            ids = [row['id'] for row in rows]
+        posts = [cls(id=id, **row) for id, row in zip(ids, rows)]
+        if is_transactional():
+            for post in posts:
+                set_committed_value(post, 'author', user)
+            bulk_index([(cls.__tablename__, post.id, None, document(post))
+                        for post in posts])
+        else:
+            SearchOutbox.enqueue(db.session, cls.__tablename__, ids)
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id == user_id).values(
+            post_count=users.c.post_count + len(rows),
+            version=users.c.version + 1))
+        _changed_users(db.session).setdefault(user_id, set())
+        db.session.commit()
+        if current_app.config['TIMELINE_CACHE']:
+            limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+            follower_ids = _follower_ids(user_id, limit + 1)
+            celebrity = len(follower_ids) > limit
+            set_celebrity(user_id, celebrity)
+            add_to_timelines([user_id] + ([] if celebrity else follower_ids),
+                             [(post.id, post.timestamp) for post in posts])
+        return posts
+
+
+class Conversation(db.Model):
+    """The messages exchanged by two users, user1_id <= user2_id."""
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id',
+                            name='uq_conversation_user1_id_user2_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def get_id(connection, user_id, other_id):
+        """Return the id of the conversation of two users, creating it."""
+        table = Conversation.__table__
+        user1_id, user2_id = sorted((user_id, other_id))
+        select = db.select([table.c.id]).where(db.and_(
+            table.c.user1_id == user1_id, table.c.user2_id == user2_id))
+        conversation_id = connection.execute(select).scalar()
+        if conversation_id is None:
+            connection.execute(pg_insert(table).values(
+                user1_id=user1_id, user2_id=user2_id,
+                timestamp=datetime.utcnow()).on_conflict_do_nothing(
+                constraint='uq_conversation_user1_id_user2_id'))
+            conversation_id = connection.execute(select).scalar()
+        return conversation_id
+
 
 class Message(db.Model):
+    __keyset__ = ['timestamp', 'id']
+    __table_args__ = (
+        db.Index('ix_message_recipient_id_timestamp_id',
+                 'recipient_id', 'timestamp', 'id'),
+        db.Index('ix_message_sender_id_timestamp_id',
+                 'sender_id', 'timestamp', 'id'),
+        db.Index('ix_message_conversation_id_timestamp_id',
+                 'conversation_id', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
     def __repr__(self):
         return '<Message {}>'.format(self.body)
 
+    @classmethod
+    def serializer(cls, only=None, expand=None):
+        """Return a Serializer of messages.
+
+        `expand=['author']` embeds the senders of the serialized messages.
+        """
+        fields = [
+            ('id', ['id'], lambda row: row.id),
+            ('conversation_id', ['conversation_id'],
+             lambda row: row.conversation_id),
+            ('sender_id', ['sender_id'], lambda row: row.sender_id),
+            ('recipient_id', ['recipient_id'], lambda row: row.recipient_id),
+            ('body', ['body'], lambda row: row.body),
+            ('timestamp', ['timestamp'],
+             lambda row: row.timestamp.isoformat() + 'Z'),
+        ]
+        expansions = {'author': ('sender_id', User.load_many)}
+        return Serializer(cls, fields, expansions, only=only, expand=expand)
+
+
+class InboxEntry(db.Model):
+    """The last message of a conversation, for each of its two users.
+
+    Rows are upserted when a message is inserted, so an inbox page is read
+    from the (user_id, timestamp, conversation_id) index whatever the number
+    of messages.
+    """
+    __tablename__ = 'inbox'
+    __keyset__ = ['timestamp', 'conversation_id']
+    __table_args__ = (
+        db.Index('ix_inbox_user_id_timestamp_conversation_id',
+                 'user_id', 'timestamp', 'conversation_id'),
+    )
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'),
+                                primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'),
+                           nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                          nullable=False)
+    body = db.Column(db.String(140))
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def serializer(cls, only=None, expand=None):
+        """Return a Serializer of inbox entries.
+
+        `expand=['other_user']` embeds the other users of the conversations.
+        """
+        messages_url = UrlTemplate('api.conversation_messages',
+                                   user_id='user_id',
+                                   conversation_id='conversation_id')
+        other_url = UrlTemplate('api.user_detail', user_id='other_id')
+        fields = [
+            ('conversation_id', ['conversation_id'],
+             lambda row: row.conversation_id),
+            ('other_user_id', ['other_id'], lambda row: row.other_id),
+            ('last_message', ['message_id', 'sender_id', 'body', 'timestamp'],
+             lambda row: {
+                 'id': row.message_id,
+                 'sender_id': row.sender_id,
+                 'body': row.body,
+                 'timestamp': row.timestamp.isoformat() + 'Z'}),
+            ('_links', ['user_id', 'conversation_id', 'other_id'],
+             lambda row: {
+                 'messages': messages_url(row),
+                 'other_user': other_url(row),
+             }),
+        ]
+        expansions = {'other_user': ('other_id', User.load_many)}
+        return Serializer(cls, fields, expansions, only=only, expand=expand)
+
 
 class Notification(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name',
+                            name='uq_notification_user_id_name'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -293,6 +948,54 @@ class Notification(db.Model):
     def get_data(self):
         return json.loads(str(self.payload_json))
 
+    @staticmethod
+    def since(user_id, since=0.0):
+        """Return the notifications of a user newer than `since`, oldest first.
+
+        They are read from the notification store when it is enabled, or from
+        the table, which Redis falls back to when unavailable.
+        """
+        if current_app.config['NOTIFICATION_STORE']:
+            items = read_notifications(user_id, since)
+            if items is not None:
+                return [Notification(user_id=user_id, **item)
+                        for item in items]
+        return Notification.query.filter(
+            Notification.user_id == user_id,
+            Notification.timestamp > since).order_by(
+            Notification.timestamp.asc()).all()
+
+    @staticmethod
+    def persist(batch_size=1000):
+        """Save the stored notifications of changed users to the table.
+
+        Rows are upserted with one INSERT .. ON CONFLICT and never replaced
+        by older values. Returns the number of users saved.
+        """
+        user_ids = take_dirty_users(batch_size)
+        if not user_ids:
+            return 0
+        try:
+            rows = [{'user_id': user_id, 'name': item['name'],
+                     'payload_json': item['payload_json'],
+                     'timestamp': item['timestamp']}
+                    for user_id, items in stored_items(user_ids).items()
+                    for item in items]
+            if rows:
+                table = Notification.__table__
+                statement = pg_insert(table).values(rows)
+                db.session.execute(statement.on_conflict_do_update(
+                    constraint='uq_notification_user_id_name',
+                    set_={'payload_json': statement.excluded.payload_json,
+                          'timestamp': statement.excluded.timestamp},
+                    where=table.c.timestamp < statement.excluded.timestamp))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            mark_dirty_users(user_ids)
+            raise
+        return len(user_ids)
+
 
 class Task(db.Model):
     id = db.Column(db.String(36), primary_key=True)
@@ -313,5 +1016,406 @@ class Task(db.Model):
         return job.meta.get('progress', 0) if job is not None else 100
 
 
-db.event.listen(db.session, 'before_commit', Post.before_commit)
-db.event.listen(db.session, 'after_commit', Post.after_commit)
+class SearchOutbox(db.Model):
+    """Search index changes waiting to be delivered by `flask search drain`.
+
+    An entry only names a document, the drain indexes its current row, or
+    deletes it when the row is gone.
+    """
+    __tablename__ = 'search_outbox'
+    __table_args__ = (
+        db.Index('ix_search_outbox_index_name_doc_id', 'index_name',
+                 'doc_id'),
+    )
+    id = db.Column(db.BigInteger, primary_key=True)
+    index_name = db.Column(db.String(64), nullable=False)
+    doc_id = db.Column(db.Integer, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    next_attempt = db.Column(db.DateTime, nullable=False, index=True,
+                             default=datetime.utcnow)
+
+    @staticmethod
+    def enqueue(session, index, doc_ids):
+        if current_app.search_backend is None or is_transactional() or \
+                not doc_ids:
+            return
+        now = datetime.utcnow()
+        session.execute(SearchOutbox.__table__.insert(), [
+            {'index_name': index, 'doc_id': doc_id, 'attempts': 0,
+             'next_attempt': now} for doc_id in doc_ids])
+
+    @staticmethod
+    def drain(batch_size=500):
+        """Deliver the oldest due entries with one _bulk request.
+
+        Entries of the same document are merged and sent with the id of the
+        newest one as external version, so deliveries that race or arrive
+        out of order never overwrite a newer document. Failed entries are
+        retried with an exponential backoff. Returns the number of delivered
+        and failed entries.
+        """
+        now = datetime.utcnow()
+        query = SearchOutbox.query.filter(
+            SearchOutbox.next_attempt <= now).order_by(
+            SearchOutbox.id).limit(batch_size)
+        if db.session.connection().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        entries = query.all()
+        if not entries:
+            db.session.commit()
+            return 0, 0
+        models = {model.__tablename__: model
+                  for model in SearchableMixin.__subclasses__()}
+        groups = {}
+        for entry in entries:
+            key = (entry.index_name, entry.doc_id)
+            if entry.index_name in models:
+                groups.setdefault(key, []).append(entry)
+            else:
+                db.session.delete(entry)
+        docs = {}
+        for index in set(index for index, _ in groups):
+            model = models[index]
+            ids = [doc_id for name, doc_id in groups if name == index]
+            docs.update(((index, obj.id), document(obj)) for obj in
+                        model.indexing_query().filter(model.id.in_(ids)))
+        keys = list(groups)
+        results = bulk_index([key + (max(e.id for e in groups[key]),
+                                     docs.get(key)) for key in keys])
+        delivered = failed = 0
+        max_backoff = current_app.config['SEARCH_OUTBOX_MAX_BACKOFF']
+        for key, ok in zip(keys, results):
+            for entry in groups[key]:
+                if ok:
+                    db.session.delete(entry)
+                    delivered += 1
+                else:
+                    entry.attempts += 1
+                    entry.next_attempt = now + timedelta(
+                        seconds=min(2 ** entry.attempts, max_backoff))
+                    failed += 1
+        db.session.commit()
+        return delivered, failed
+
+
+def _follower_ids(user_id, limit):
+    return [id for id, in db.session.query(followers.c.follower_id).filter(
+        followers.c.followed_id == user_id).limit(limit)]
+
+
+def _recent_posts(user_id, limit):
+    return db.session.query(Post.id, Post.timestamp).filter(
+        Post.user_id == user_id).order_by(
+        Post.timestamp.desc(), Post.id.desc()).limit(limit).all()
+
+
+def timeline_before_commit(session):
+    """Collect the timeline updates implied by the pending changes.
+
+    Follower lists are read here because no SQL can be emitted from
+    after_commit; Redis is only written once the transaction is committed.
+    """
+    added = [obj for obj in session.new if isinstance(obj, Post)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Post)]
+    follows = []
+    for user in session.dirty:
+        if isinstance(user, User):
+            history = get_history(user, 'followed',
+                                  passive=PASSIVE_NO_INITIALIZE)
+            follows.extend((user.id, followed.id, True)
+                           for followed in history.added)
+            follows.extend((user.id, followed.id, False)
+                           for followed in history.deleted)
+    session._timeline_changes = None
+    if not (added or deleted or follows) or \
+            not current_app.config['TIMELINE_CACHE']:
+        return
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    length = current_app.config['TIMELINE_LENGTH']
+    changes = {'add': [], 'delete': [], 'follow': [], 'unfollow': []}
+    for post in added:
+        user_id = post.user_id or post.author.id
+        follower_ids = _follower_ids(user_id, limit + 1)
+        celebrity = len(follower_ids) > limit
+        changes['add'].append((post, user_id, celebrity,
+                               [] if celebrity else follower_ids))
+    for post in deleted:
+        follower_ids = _follower_ids(post.user_id, limit + 1)
+        changes['delete'].append((post.id, [post.user_id] + follower_ids))
+    for user_id, followed_id, follow in follows:
+        key = 'follow' if follow else 'unfollow'
+        changes[key].append((user_id, _recent_posts(followed_id, length)))
+    session._timeline_changes = changes
+
+
+def timeline_after_commit(session):
+    changes = getattr(session, '_timeline_changes', None)
+    if not changes:
+        return
+    for post, user_id, celebrity, follower_ids in changes['add']:
+        set_celebrity(user_id, celebrity)
+        add_to_timelines([user_id] + follower_ids, [(post.id, post.timestamp)])
+    for post_id, user_ids in changes['delete']:
+        remove_from_timelines(user_ids, [post_id])
+    for user_id, entries in changes['follow']:
+        add_to_timelines([user_id], entries)
+    for user_id, entries in changes['unfollow']:
+        remove_from_timelines([user_id], [id for id, _ in entries])
+    session._timeline_changes = None
+
+
+def counters_after_flush(session, flush_context):
+    """Apply the changes of a flush to the denormalized User counters.
+
+    Counters are changed with relative UPDATEs in the flush transaction, so
+    concurrent writers never overwrite each other.
+    """
+    deltas = {}
+
+    def change(user_id, name, delta):
+        if user_id is not None:
+            counters = deltas.setdefault(user_id, {})
+            counters[name] = counters.get(name, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, Post):
+            change(obj.user_id, 'post_count', 1)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            change(obj.user_id, 'post_count', -1)
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            history = get_history(obj, 'user_id')
+            for user_id in history.deleted:
+                change(user_id, 'post_count', -1)
+            for user_id in history.added:
+                change(user_id, 'post_count', 1)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = get_history(obj, 'followed',
+                                  passive=PASSIVE_NO_INITIALIZE)
+            for followed in history.added:
+                change(obj.id, 'followed_count', 1)
+                change(followed.id, 'follower_count', 1)
+            for followed in history.deleted:
+                change(obj.id, 'followed_count', -1)
+                change(followed.id, 'follower_count', -1)
+    user = User.__table__
+    for user_id, counters in deltas.items():
+        counters = {name: user.c[name] + delta
+                    for name, delta in counters.items() if delta}
+        if counters:
+            counters['version'] = user.c.version + 1
+            session.execute(user.update().where(
+                user.c.id == user_id).values(counters))
+    for user_id in deltas:
+        _changed_users(session).setdefault(user_id, set())
+    session._counter_deltas = deltas
+
+
+def counters_after_flush_postexec(session, flush_context):
+    deltas = getattr(session, '_counter_deltas', None)
+    if not deltas:
+        return
+    for user_id, counters in deltas.items():
+        user = session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            session.expire(user, list(counters) + ['version'])
+    session._counter_deltas = None
+
+
+def _changed_users(session):
+    return session.info.setdefault('changed_users', {})
+
+
+def users_after_update(mapper, connection, target):
+    """Remember updated users, and their previous usernames."""
+    usernames = _changed_users(db.object_session(target)).setdefault(
+        target.id, set())
+    usernames.add(target.username)
+    usernames.update(get_history(target, 'username').deleted)
+
+
+def users_after_delete(mapper, connection, target):
+    _changed_users(db.object_session(target)).setdefault(
+        target.id, set()).add(target.username)
+
+
+def users_after_commit(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        invalidate_users(list(changed), set().union(*changed.values()) -
+                         {None})
+
+
+def users_after_rollback(session):
+    session.info.pop('changed_users', None)
+
+
+def tokens_after_flush(session, flush_context):
+    """Remember the tokens that were replaced, revoked or deleted.
+
+    They are only invalidated once the transaction is committed, so that no
+    worker can cache them again from rows that are not yet updated.
+    """
+    tokens = session.info.setdefault('changed_tokens', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            tokens.update(get_history(obj, 'token').deleted)
+            if get_history(obj, 'token_expiration').deleted:
+                tokens.add(obj.token)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            tokens.add(obj.token)
+    tokens.discard(None)
+
+
+def tokens_after_commit(session):
+    invalidate_tokens(session.info.pop('changed_tokens', None))
+
+
+def tokens_after_rollback(session):
+    session.info.pop('changed_tokens', None)
+
+
+def suggest_after_flush(session, flush_context):
+    """Remember usernames to add to and remove from the suggestion index."""
+    changes = session.info.setdefault('suggest_changes', {})
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes[(obj.id, obj.username)] = False
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            history = get_history(obj, 'username')
+            if history.has_changes():
+                changes.update(((obj.id, name), False)
+                               for name in history.deleted if name)
+                changes[(obj.id, obj.username)] = True
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes[(obj.id, obj.username)] = True
+
+
+def suggest_after_commit(session):
+    changes = session.info.pop('suggest_changes', None)
+    if changes:
+        update_suggestions(
+            [pair for pair, present in changes.items() if present],
+            [pair for pair, present in changes.items() if not present])
+
+
+def suggest_after_rollback(session):
+    session.info.pop('suggest_changes', None)
+
+
+def messages_before_insert(mapper, connection, target):
+    if target.conversation_id is None:
+        target.conversation_id = Conversation.get_id(
+            connection, target.sender_id, target.recipient_id)
+
+
+def messages_after_insert(mapper, connection, target):
+    """Make the message the last one of its conversation in both inboxes."""
+    participants = {target.sender_id: target.recipient_id,
+                    target.recipient_id: target.sender_id}
+    table = InboxEntry.__table__
+    statement = pg_insert(table).values([
+        {'user_id': user_id, 'conversation_id': target.conversation_id,
+         'other_id': other_id, 'message_id': target.id,
+         'sender_id': target.sender_id, 'body': target.body,
+         'timestamp': target.timestamp}
+        for user_id, other_id in participants.items()])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'conversation_id'],
+        set_={name: statement.excluded[name] for name in
+              ('message_id', 'sender_id', 'body', 'timestamp')},
+        where=db.tuple_(table.c.timestamp, table.c.message_id) <
+        db.tuple_(statement.excluded.timestamp,
+                  statement.excluded.message_id)))
+
+
+def unread_after_flush(session, flush_context):
+    """Remember received and read messages, counted once committed."""
+    received, read = session.info.setdefault('unread_changes', ({}, set()))
+    for obj in session.new:
+        if isinstance(obj, Message) and obj.recipient_id is not None:
+            received[obj.recipient_id] = received.get(obj.recipient_id, 0) + 1
+    for obj in session.dirty:
+        if isinstance(obj, User) and \
+                get_history(obj, 'last_message_read_time').has_changes():
+            read.add(obj.id)
+
+
+def unread_after_commit(session):
+    changes = session.info.pop('unread_changes', None)
+    if changes:
+        update_unread(*changes)
+
+
+def unread_after_rollback(session):
+    session.info.pop('unread_changes', None)
+
+
+def notifications_after_flush(session, flush_context):
+    """Remember new notifications, published once they are committed."""
+    published = session.info.setdefault('new_notifications', [])
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            published.append((obj.user_id, obj.name, obj.payload_json,
+                              obj.timestamp))
+
+
+def notifications_after_commit(session):
+    items = session.info.pop('new_notifications', None)
+    store_notifications(items)
+    publish_notifications(items)
+
+
+def notifications_after_rollback(session):
+    session.info.pop('new_notifications', None)
+
+
+def search_after_commit(session):
+    bump_generations(session.info.pop('changed_indexes', None))
+
+
+def search_after_rollback(session):
+    session.info.pop('changed_indexes', None)
+
+
+def bump_version(mapper, connection, target):
+    """Increment the version of rows whose columns change, for ETags."""
+    if db.object_session(target).is_modified(target,
+                                             include_collections=False):
+        target.version = mapper.class_.version + 1
+
+
+db.event.listen(User, 'before_update', bump_version)
+db.event.listen(Post, 'before_update', bump_version)
+db.event.listen(db.session, 'after_flush', counters_after_flush)
+db.event.listen(db.session, 'after_flush_postexec',
+                counters_after_flush_postexec)
+db.event.listen(db.session, 'after_flush', Post.after_flush)
+db.event.listen(db.session, 'after_commit', search_after_commit)
+db.event.listen(db.session, 'after_rollback', search_after_rollback)
+db.event.listen(db.session, 'before_commit', timeline_before_commit)
+db.event.listen(db.session, 'after_commit', timeline_after_commit)
+db.event.listen(User, 'after_update', users_after_update)
+db.event.listen(User, 'after_delete', users_after_delete)
+db.event.listen(db.session, 'after_commit', users_after_commit)
+db.event.listen(db.session, 'after_rollback', users_after_rollback)
+db.event.listen(db.session, 'after_flush', tokens_after_flush)
+db.event.listen(db.session, 'after_flush', suggest_after_flush)
+db.event.listen(Message, 'before_insert', messages_before_insert)
+db.event.listen(Message, 'after_insert', messages_after_insert)
+db.event.listen(db.session, 'after_flush', unread_after_flush)
+db.event.listen(db.session, 'after_commit', unread_after_commit)
+db.event.listen(db.session, 'after_rollback', unread_after_rollback)
+db.event.listen(db.session, 'after_flush', notifications_after_flush)
+db.event.listen(db.session, 'after_commit', notifications_after_commit)
+db.event.listen(db.session, 'after_rollback', notifications_after_rollback)
+db.event.listen(db.session, 'after_commit', suggest_after_commit)
+db.event.listen(db.session, 'after_rollback', suggest_after_rollback)
+db.event.listen(db.session, 'after_commit', tokens_after_commit)
+db.event.listen(db.session, 'after_rollback', tokens_after_rollback)
@@ -0,0 +1,225 @@
+"""Notification store and live delivery with Server-Sent Events.
+
+With NOTIFICATION_STORE the latest notification of each name is kept in a
+per-user Redis hash, indexed by timestamp in a sorted set, and replaced
+atomically by a script. The notification table is then only written in
+batches by `flask notifications persist` for durability.
+
+Notifications are published on the `notifications:<user id>` Redis channel
+once committed. Each process holds a single pattern subscription and hands
+the messages to the streams of its connected users, so an idle stream costs
+a queue rather than a Redis connection. Streams are served by the gevent
+workers of the `app-stream` service, which hold thousands of them at once;
+NOTIFICATION_STREAM is off elsewhere and browsers poll instead.
+"""
+import json
+import os
+import threading
+import time
+from queue import Empty, Queue
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+CHANNEL_PREFIX = 'notifications:'
+DIRTY_KEY = 'notifications:dirty'
+
+# KEYS: the hash and sorted set of a user, ARGV: ttl, then name, timestamp
+# and JSON item triples. An older item never replaces a newer one.
+_STORE_SCRIPT = """
+for i = 2, #ARGV, 3 do
+    local current = redis.call('zscore', KEYS[2], ARGV[i])
+    if not current or tonumber(current) <= tonumber(ARGV[i + 1]) then
+        redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 2])
+        redis.call('zadd', KEYS[2], ARGV[i + 1], ARGV[i])
+    end
+end
+redis.call('expire', KEYS[1], ARGV[1])
+redis.call('expire', KEYS[2], ARGV[1])
+"""
+
+# KEYS: the hash and sorted set of a user, ARGV: the exclusive lower bound.
+_READ_SCRIPT = """
+local names = redis.call('zrangebyscore', KEYS[2], '(' .. ARGV[1], '+inf')
+if #names == 0 then
+    return {}
+end
+return redis.call('hmget', KEYS[1], unpack(names))
+"""
+
+_streams = {}
+_streams_lock = threading.Lock()
+_hub = {'pid': None}
+_hub_lock = threading.Lock()
+
+
+def _store_keys(user_id):
+    return ['notifications:{}:items'.format(user_id),
+            'notifications:{}:times'.format(user_id)]
+
+
+def store_notifications(items):
+    """Save committed (user_id, name, payload_json, timestamp) items.
+
+    The users are marked for `flask notifications persist`. Items are lost
+    when Redis is unavailable; they are counters and progress values that
+    the next notification of the same name replaces anyway.
+    """
+    if not current_app.config['NOTIFICATION_STORE'] or not items:
+        return
+    by_user = {}
+    for user_id, name, payload_json, timestamp in items:
+        by_user.setdefault(user_id, []).extend([
+            name, repr(timestamp),
+            json.dumps({'name': name, 'payload_json': payload_json,
+                        'timestamp': timestamp})])
+    try:
+        store = current_app.redis.register_script(_STORE_SCRIPT)
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id, args in by_user.items():
+            store(keys=_store_keys(user_id),
+                  args=[current_app.config['NOTIFICATION_STORE_TTL']] + args,
+                  client=pipe)
+        if current_app.config['NOTIFICATION_PERSIST']:
+            pipe.sadd(DIRTY_KEY, *by_user)
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Notification store failed',
+                                   exc_info=True)
+
+
+def read_notifications(user_id, since):
+    """Return the stored items of a user newer than `since`, oldest first.
+
+    Items are dicts with the name, payload_json and timestamp. None is
+    returned when Redis is unavailable.
+    """
+    try:
+        read = current_app.redis.register_script(_READ_SCRIPT)
+        values = read(keys=_store_keys(user_id), args=[repr(since)])
+    except RedisError:
+        current_app.logger.warning('Notification read failed', exc_info=True)
+        return None
+    items = [json.loads(value.decode('utf-8')) for value in values if value]
+    return sorted(items, key=lambda item: item['timestamp'])
+
+
+def take_dirty_users(count):
+    """Pop up to `count` users whose stored notifications are not saved."""
+    return [int(user_id) for user_id in current_app.redis.execute_command(
+        'SPOP', DIRTY_KEY, count) or ()]
+
+
+def mark_dirty_users(user_ids):
+    """Put back users whose notifications could not be saved."""
+    if user_ids:
+        current_app.redis.sadd(DIRTY_KEY, *user_ids)
+
+
+def stored_items(user_ids):
+    """Return the stored items of users as a {user_id: [item]} dict."""
+    pipe = current_app.redis.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.hvals(_store_keys(user_id)[0])
+    return {user_id: [json.loads(value.decode('utf-8')) for value in values]
+            for user_id, values in zip(user_ids, pipe.execute())}
+
+
+def publish_notifications(items):
+    """Publish committed (user_id, name, payload_json, timestamp) items."""
+    if not current_app.config['NOTIFICATION_STREAM'] or not items:
+        return
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id, name, payload_json, timestamp in items:
+            pipe.publish(CHANNEL_PREFIX + str(user_id), json.dumps(
+                {'name': name, 'data': json.loads(payload_json),
+                 'timestamp': timestamp}))
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Notification publish failed',
+                                   exc_info=True)
+
+
+def _dispatch(user_id, data):
+    with _streams_lock:
+        queues = list(_streams.get(user_id, ()))
+    for queue in queues:
+        queue.put(data)
+
+
+def _listen(redis):
+    while True:
+        try:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(CHANNEL_PREFIX + '*')
+            # Messages published while unsubscribed were missed, streams
+            # read them again from the store.
+            for user_id in list(_streams):
+                _dispatch(user_id, None)
+            for message in pubsub.listen():
+                if message.get('type') != 'pmessage':
+                    continue
+                channel = message['channel'].decode('utf-8')
+                _dispatch(int(channel[len(CHANNEL_PREFIX):]),
+                          message['data'].decode('utf-8'))
+        except (RedisError, ValueError):
+            time.sleep(1)
+
+
+def _start_hub():
+    """Subscribe this process to notification messages, once per process."""
+    if _hub['pid'] == os.getpid():
+        return
+    with _hub_lock:
+        if _hub['pid'] == os.getpid():
+            return
+        thread = threading.Thread(target=_listen, args=(current_app.redis,),
+                                  name='notification-hub')
+        thread.daemon = True
+        thread.start()
+        _hub['pid'] = os.getpid()
+
+
+def _event(item):
+    return 'id: {!r}\ndata: {}\n\n'.format(item['timestamp'],
+                                          json.dumps(item))
+
+
+def stream_notifications(user_id, since, backlog):
+    """Yield the notifications of a user as Server-Sent Events.
+
+    `backlog(since)` returns the stored notifications newer than `since`. It
+    is read after subscribing, and again whenever the subscription was lost,
+    so no notification falls in between. The stream ends after
+    NOTIFICATION_STREAM_DURATION seconds, browsers then reconnect with the
+    last event id.
+    """
+    heartbeat = current_app.config['NOTIFICATION_STREAM_HEARTBEAT']
+    end = time.time() + current_app.config['NOTIFICATION_STREAM_DURATION']
+    queue = Queue()
+    _start_hub()
+    with _streams_lock:
+        _streams.setdefault(user_id, set()).add(queue)
+    try:
+        yield 'retry: 5000\n\n'
+        pending = backlog(since)
+        while time.time() < end:
+            for item in pending:
+                if item['timestamp'] > since:
+                    since = item['timestamp']
+                    yield _event(item)
+            try:
+                data = queue.get(timeout=heartbeat)
+            except Empty:
+                yield ': keepalive\n\n'
+                pending = []
+                continue
+            pending = backlog(since) if data is None else [json.loads(data)]
+    finally:
+        with _streams_lock:
+            queues = _streams.get(user_id, set())
+            queues.discard(queue)
+            if not queues:
+                _streams.pop(user_id, None)
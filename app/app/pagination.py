@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+from werkzeug.exceptions import BadRequest
+
+from app import db
+
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+TOTAL_MODES = ('exact', 'estimate', 'none')
+
+
+class InvalidCursor(BadRequest):
+    description = 'invalid pagination cursor'
+
+
+class InvalidTotalMode(BadRequest):
+    description = 'total must be one of exact, estimate or none'
+
+
+def _keyset_columns(model):
+    return [getattr(model, key) for key in model.__keyset__]
+
+
+def encode_cursor(values):
+    data = json.dumps([value.strftime(CURSOR_DATETIME_FORMAT)
+                       if isinstance(value, datetime) else value
+                       for value in values])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode(
+        'ascii').rstrip('=')
+
+
+def decode_cursor(cursor, model):
+    """Return the keyset values of `model` encoded in an opaque cursor."""
+    columns = _keyset_columns(model)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.strptime(value, CURSOR_DATETIME_FORMAT)
+            if isinstance(column.type, db.DateTime) else int(value)
+            for column, value in zip(columns, values))
+    except (ValueError, TypeError):
+        raise InvalidCursor
+
+
+def keyset(query, after=None, before=None):
+    """Order a query by its model's __keyset__ columns, newest first.
+
+    With an `after` cursor only rows that follow it are selected. With a
+    `before` cursor only rows that precede it are selected and the order is
+    reversed, so that a limit picks the rows closest to the cursor.
+    """
+    model = query.column_descriptions[0]['entity']
+    columns = _keyset_columns(model)
+    query = query.order_by(None)
+    if before is not None:
+        values = decode_cursor(before, model)
+        return query.filter(db.tuple_(*columns) > db.tuple_(*values)). \
+            order_by(*[column.asc() for column in columns])
+    if after is not None:
+        values = decode_cursor(after, model)
+        query = query.filter(db.tuple_(*columns) < db.tuple_(*values))
+    return query.order_by(*[column.desc() for column in columns])
+
+
+class Page(object):
+    def __init__(self, items, has_next, has_prev, keys):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.keys = keys
+
+    def _cursor(self, item):
+        return encode_cursor([getattr(item, key) for key in self.keys])
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1]) if self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor(self.items[0]) if self.items else None
+
+
+def page_query(query, per_page, page=1, after=None, before=None):
+    """Return the query selecting one page of rows, plus one to probe for
+    more rows in the paging direction."""
+    query = keyset(query, after, before)
+    if before is None and after is None and page > 1:
+        query = query.offset((page - 1) * per_page)
+    return query.limit(per_page + 1)
+
+
+def paginate(query, per_page, page=1, after=None, before=None):
+    """Return a Page of a query, using keyset pagination.
+
+    `page` is kept for old URLs: when no cursor is given and page is past the
+    first one, rows are skipped with an offset. The query may select column
+    tuples, as long as they include the __keyset__ columns of the model.
+    """
+    keys = query.column_descriptions[0]['entity'].__keyset__
+    items = page_query(query, per_page, page, after, before).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if before is not None:
+        items.reverse()
+        return Page(items, True, has_more, keys)
+    return Page(items, has_more, after is not None or page > 1, keys)
+
+
+def _planner_estimate(query):
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    compiled = query.statement.compile(dialect=connection.dialect)
+    plan = connection.execute('EXPLAIN (FORMAT JSON) ' + compiled.string,
+                              compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_count(query):
+    """Return an approximate number of rows of a query.
+
+    Counts are cached in Redis for COUNT_CACHE_TTL seconds. On a cache miss
+    the PostgreSQL planner estimate is used when it is above
+    COUNT_ESTIMATE_THRESHOLD, smaller results are counted exactly.
+    """
+    ttl = current_app.config['COUNT_CACHE_TTL']
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    key = 'count:' + hashlib.sha1('{}{}'.format(
+        compiled.string, sorted(compiled.params.items())).encode(
+        'utf-8')).hexdigest()
+    if ttl:
+        try:
+            cached = current_app.redis.get(key)
+            if cached is not None:
+                return int(cached)
+        except RedisError:
+            pass
+    total = _planner_estimate(query)
+    if total is None or \
+            total < current_app.config['COUNT_ESTIMATE_THRESHOLD']:
+        total = query.count()
+    if ttl:
+        try:
+            current_app.redis.set(key, total, ex=ttl)
+        except RedisError:
+            pass
+    return total
+
+
+def count(query, mode='exact'):
+    """Return the total of a collection according to a ?total= mode."""
+    if mode not in TOTAL_MODES:
+        raise InvalidTotalMode
+    if mode == 'none':
+        return None
+    query = query.order_by(None)
+    if mode == 'estimate':
+        return estimate_count(query)
+    return query.count()
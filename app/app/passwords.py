@@ -0,0 +1,70 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, \
+    check_password_hash, generate_password_hash
+
+
+_pool = {'pid': None, 'executor': None, 'slots': None}
+_pool_lock = threading.Lock()
+
+
+class PasswordHashingBusy(ServiceUnavailable):
+    description = 'too many logins in progress, please retry later'
+
+
+def hash_method():
+    """Return PASSWORD_HASH_METHOD in the form stored in password hashes."""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method += ':{}'.format(DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+def _slots():
+    """Return the hashing executor of this process and its admission slots.
+
+    Up to PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE
+    more may wait, further requests are refused instead of piling up.
+    hashlib releases the GIL while hashing, so the pool uses several cores
+    and request threads stay free to serve other requests.
+    """
+    if _pool['pid'] != os.getpid():
+        with _pool_lock:
+            if _pool['pid'] != os.getpid():
+                workers = current_app.config['PASSWORD_HASH_WORKERS']
+                _pool['executor'] = ThreadPoolExecutor(max_workers=workers)
+                _pool['slots'] = threading.BoundedSemaphore(
+                    workers + current_app.config['PASSWORD_HASH_QUEUE'])
+                _pool['pid'] = os.getpid()
+    return _pool['executor'], _pool['slots']
+
+
+def _run(func, *args):
+    executor, slots = _slots()
+    if not slots.acquire(blocking=False):
+        raise PasswordHashingBusy
+    try:
+        future = executor.submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda future: slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, hash_method(),
+                current_app.config['PASSWORD_SALT_LENGTH'])
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Tell whether a hash was made with other parameters than configured."""
+    return password_hash.split('$', 1)[0] != hash_method()
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+LAST_SEEN_KEY = 'last_seen'
+EPOCH = datetime(1970, 1, 1)
+
+# Read and empty the buffer in one step, so that updates recorded during a
+# flush are kept for the next one.
+_TAKE_SCRIPT = """
+local data = redis.call('hgetall', KEYS[1])
+redis.call('del', KEYS[1])
+return data
+"""
+
+
+def _enabled():
+    return current_app.config['LAST_SEEN_BUFFER']
+
+
+def _timestamp(when):
+    return (when - EPOCH).total_seconds()
+
+
+def record_last_seen(user_id, when):
+    """Buffer the last_seen time of a user in Redis.
+
+    Repeated updates of a user overwrite each other until the next flush.
+    Returns False when the update could not be buffered and has to be
+    written to the database instead.
+    """
+    if not _enabled():
+        return False
+    try:
+        current_app.redis.hset(LAST_SEEN_KEY, user_id, _timestamp(when))
+    except RedisError:
+        return False
+    return True
+
+
+def buffered_last_seen(user_ids):
+    """Return the buffered last_seen times of users, by id."""
+    user_ids = list(user_ids)
+    if not _enabled() or not user_ids:
+        return {}
+    try:
+        values = current_app.redis.hmget(LAST_SEEN_KEY, user_ids)
+    except RedisError:
+        return {}
+    return {user_id: datetime.utcfromtimestamp(float(value))
+            for user_id, value in zip(user_ids, values) if value is not None}
+
+
+def take_last_seen():
+    """Remove and return every buffered last_seen time, by user id."""
+    take = current_app.redis.register_script(_TAKE_SCRIPT)
+    data = take(keys=[LAST_SEEN_KEY])
+    return {int(user_id): datetime.utcfromtimestamp(float(value))
+            for user_id, value in zip(data[::2], data[1::2])}
+
+
+def restore_last_seen(last_seen):
+    """Put back times taken by a flush that failed, unless newer ones were
+    recorded meanwhile."""
+    pipe = current_app.redis.pipeline(transaction=False)
+    for user_id, when in last_seen.items():
+        pipe.hsetnx(LAST_SEEN_KEY, user_id, _timestamp(when))
+    pipe.execute()
@@ -0,0 +1,157 @@
+"""Rebuild a search index without downtime.
+
+Objects are streamed from the database in primary key order with a server-side
+cursor and sent in chunks to a pool of processes issuing _bulk requests into
+a new versioned index, e.g. post-20261018153000. While it is built the index
+is also reachable as the `<name>-next` alias, which the outbox drain writes
+to as well, so changes made during the rebuild are not lost. When every row
+is indexed the `<name>` alias is switched to the new index in one atomic
+update_aliases call.
+
+Progress is saved to a checkpoint file after each contiguous run of indexed
+chunks; running the command again resumes from it.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.search import document
+
+
+RETRIES = 5
+
+_client = {}
+
+
+def _init_worker(url):
+    from elasticsearch import Elasticsearch
+    _client['es'] = Elasticsearch([url])
+
+
+def _send(body):
+    """Send one chunk from a pool process, retrying with backoff."""
+    from elasticsearch.exceptions import ElasticsearchException
+    for attempt in range(RETRIES):
+        try:
+            response = _client['es'].bulk(body=body)
+        except ElasticsearchException:
+            if attempt == RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        # 409: a newer version was written by the outbox drain meanwhile.
+        failed = [item for item in response['items']
+                  if list(item.values())[0].get('status', 500) >= 300 and
+                  list(item.values())[0].get('status') != 409]
+        if not failed:
+            return len(response['items'])
+        if attempt == RETRIES - 1:
+            raise RuntimeError('{} documents were rejected: {}'.format(
+                len(failed), failed[0]))
+        time.sleep(2 ** attempt)
+
+
+def _load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def _save_checkpoint(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _chunk_body(index, name, objects):
+    body = []
+    for obj in objects:
+        # Version 0 loses against any change delivered by the outbox drain.
+        body.append({'index': {'_index': index, '_type': name, '_id': obj.id,
+                               'version': 0, 'version_type': 'external_gte'}})
+        body.append(document(obj))
+    return body
+
+
+def reindex(model, workers=None, chunk_size=1000, checkpoint=None,
+            keep_old=False, echo=print):
+    """Rebuild the search index of a searchable model and switch to it."""
+    es = current_app.elasticsearch
+    name = model.__tablename__
+    state = _load_checkpoint(checkpoint) or {
+        'index': '{}-{}'.format(name,
+                                datetime.utcnow().strftime('%Y%m%d%H%M%S')),
+        'last_id': 0,
+        'done': 0}
+    index = state['index']
+    if not es.indices.exists(index=index):
+        es.indices.create(index=index, body={
+            'settings': {'refresh_interval': '-1', 'number_of_replicas': 0},
+            # Stored for rendering search results only, not searched.
+            'mappings': {name: {'properties': {
+                'source': {'type': 'object', 'enabled': False}}}}})
+        es.indices.put_alias(index=index, name=name + '-next')
+    elif state['done']:
+        echo('Resuming {} after id {}'.format(index, state['last_id']))
+    total = model.query.count()
+    rows = model.indexing_query().filter(model.id > state['last_id']). \
+        order_by(model.id).yield_per(chunk_size)
+    workers = workers or os.cpu_count() or 1
+    pending = []
+
+    def complete_oldest():
+        future, last_id = pending.pop(0)
+        state['done'] += future.result()
+        state['last_id'] = last_id
+        if checkpoint:
+            _save_checkpoint(checkpoint, state)
+        echo('{}: {}/{} documents ({:.0%})'.format(
+            index, state['done'], total,
+            state['done'] / float(total) if total else 1))
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(current_app.config[
+                                 'ELASTICSEARCH_URL'],)) as pool:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) < chunk_size:
+                continue
+            pending.append((pool.submit(
+                _send, _chunk_body(index, name, chunk)), chunk[-1].id))
+            chunk = []
+            while len(pending) >= 2 * workers:
+                complete_oldest()
+        if chunk:
+            pending.append((pool.submit(
+                _send, _chunk_body(index, name, chunk)), chunk[-1].id))
+        while pending:
+            complete_oldest()
+
+    es.indices.put_settings(index=index, body={'index': {
+        'refresh_interval': '1s',
+        'number_of_replicas': current_app.config['SEARCH_INDEX_REPLICAS']}})
+    es.indices.refresh(index=index)
+    actions = [{'remove': {'index': index, 'alias': name + '-next'}},
+               {'add': {'index': index, 'alias': name}}]
+    old = []
+    if es.indices.exists_alias(name=name):
+        old = [i for i in es.indices.get_alias(name=name) if i != index]
+        actions += [{'remove': {'index': i, 'alias': name}} for i in old]
+    elif es.indices.exists(index=name):
+        # An index created before aliases were used holds the name of the
+        # alias. Elasticsearch 6.2 cannot remove it within the alias update,
+        # so it is deleted first and searches fail until the swap is done.
+        es.indices.delete(index=name)
+    es.indices.update_aliases(body={'actions': actions})
+    echo('{} now points to {}'.format(name, index))
+    if old and not keep_old:
+        es.indices.delete(index=','.join(old))
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
@@ -1,29 +1,366 @@
+import base64
+import decimal
+import hashlib
+import json
+import numbers
+
+from elasticsearch.exceptions import ElasticsearchException
 from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, \
+    insert as pg_insert
+
+from app import db
+from app.pagination import InvalidCursor, encode_cursor
+
+
+# Documents of the database backend, one row per indexed object.
+search_documents = db.Table(
+    'search_document',
+    db.Column('index_name', db.String(64), primary_key=True),
+    db.Column('doc_id', db.Integer, primary_key=True),
+    db.Column('vector', TSVECTOR, nullable=False),
+    db.Column('source', JSONB),
+    db.Index('ix_search_document_vector', 'vector', postgresql_using='gin')
+)
+
+
+def document(model):
+    """Return the document indexed for a searchable object.
+
+    With SEARCH_STORE_SOURCE the fields needed to render a search result are
+    stored under 'source', so results can be shown without the database.
+    """
+    doc = {field: getattr(model, field) for field in model.__searchable__}
+    if current_app.config['SEARCH_STORE_SOURCE']:
+        doc['source'] = model.search_source()
+    return doc
+
+
+class ElasticsearchBackend(object):
+    """Index documents in an Elasticsearch cluster.
+
+    Changes are delivered after commit by the search outbox drain.
+    """
+    transactional = False
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, index, id, doc):
+        self.client.index(index=index, doc_type=index, id=id, body=doc)
+
+    def remove(self, index, id):
+        self.client.delete(index=index, doc_type=index, id=id)
+
+    def _write_targets(self, index):
+        """Return the index to write, plus the one being rebuilt if any."""
+        building = index + '-next'
+        if self.client.indices.exists_alias(name=building):
+            return [index, building]
+        return [index]
+
+    def bulk(self, actions):
+        body = []
+        positions = []
+        try:
+            targets = {index: self._write_targets(index)
+                       for index in set(action[0] for action in actions)}
+            for i, (index, id, version, doc) in enumerate(actions):
+                for target in targets[index]:
+                    meta = {'_index': target, '_type': index, '_id': id,
+                            'version': version,
+                            'version_type': 'external_gte'}
+                    if doc is None:
+                        body.append({'delete': meta})
+                    else:
+                        body.append({'index': meta})
+                        body.append(doc)
+                    positions.append(i)
+            response = self.client.bulk(body=body)
+        except ElasticsearchException:
+            current_app.logger.warning('Bulk indexing failed', exc_info=True)
+            return [False] * len(actions)
+        results = [True] * len(actions)
+        for i, item in zip(positions, response['items']):
+            status = list(item.values())[0].get('status', 500)
+            # 404: deleting a missing entry, 409: a newer version is indexed.
+            if not (status < 300 or status in (404, 409)):
+                results[i] = False
+        return results
+
+    def query(self, index, query, fields, per_page, after):
+        body = {'query': {'multi_match': {'query': query, 'fields': fields}},
+                '_source': ['source'],
+                'sort': [{'_score': 'desc'}, {'_id': 'desc'}],
+                'size': per_page + 1}
+        if after:
+            if isinstance(after[0], str):
+                raise InvalidCursor
+            body['search_after'] = after
+        found = self.client.search(index=index, doc_type=index,
+                                   body=body)['hits']['hits']
+        hits = [(int(hit['_id']), hit.get('_source', {}).get('source'))
+                for hit in found[:per_page]]
+        return hits, found[per_page - 1]['sort'] \
+            if len(found) > per_page else None
+
+    def reindex(self, model, **options):
+        from app.reindex import reindex
+        reindex(model, **options)
+        bump_generations([model.__tablename__])
+
+
+class DatabaseBackend(object):
+    """Index documents in a PostgreSQL tsvector column with a GIN index.
+
+    Documents are written by the session that changes the indexed rows, so
+    they are committed or rolled back together with them.
+    """
+    transactional = True
+    rank_scale = 6
+
+    def __init__(self, ts_config):
+        self.ts_config = ts_config
+
+    def _vector(self, doc):
+        text = ' '.join(str(value) for name, value in doc.items()
+                        if name != 'source' and value is not None)
+        return db.func.to_tsvector(self.ts_config, text)
+
+    def add(self, index, id, doc):
+        self.bulk([(index, id, None, doc)])
+
+    def remove(self, index, id):
+        self.bulk([(index, id, None, None)])
+
+    def bulk(self, actions):
+        added = {}
+        removed = {}
+        for index, id, _, doc in actions:
+            if doc is None:
+                added.pop((index, id), None)
+                removed[(index, id)] = True
+            else:
+                removed.pop((index, id), None)
+                added[(index, id)] = doc
+        for index, id in removed:
+            db.session.execute(search_documents.delete().where(db.and_(
+                search_documents.c.index_name == index,
+                search_documents.c.doc_id == id)))
+        if added:
+            statement = pg_insert(search_documents).values([
+                {'index_name': index, 'doc_id': id,
+                 'vector': self._vector(doc), 'source': doc.get('source')}
+                for (index, id), doc in added.items()])
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['index_name', 'doc_id'],
+                set_={'vector': statement.excluded.vector,
+                      'source': statement.excluded.source}))
+        return [True] * len(actions)
+
+    def query(self, index, query, fields, per_page, after):
+        tsquery = db.func.plainto_tsquery(self.ts_config, query)
+        # ts_rank returns a real, which is rounded when sent to the client.
+        # Ranks are ordered and compared as numerics of a fixed scale, and
+        # cursors carry them as strings, so a page ends exactly where the
+        # next one starts.
+        rank = db.func.round(db.cast(
+            db.func.ts_rank(search_documents.c.vector, tsquery), db.Numeric),
+            self.rank_scale)
+        matches = db.session.query(
+            search_documents.c.doc_id, search_documents.c.source,
+            rank).filter(
+            search_documents.c.index_name == index,
+            search_documents.c.vector.op('@@')(tsquery))
+        if after:
+            try:
+                after_rank = decimal.Decimal(str(after[0]))
+            except decimal.InvalidOperation:
+                raise InvalidCursor
+            matches = matches.filter(
+                db.tuple_(rank, search_documents.c.doc_id) <
+                (after_rank, after[1]))
+        rows = matches.order_by(rank.desc(),
+                                search_documents.c.doc_id.desc()). \
+            limit(per_page + 1).all()
+        hits = [(doc_id, source) for doc_id, source, _ in rows[:per_page]]
+        if len(rows) <= per_page:
+            return hits, None
+        doc_id, _, last_rank = rows[per_page - 1]
+        return hits, [str(last_rank), doc_id]
+
+    def reindex(self, model, chunk_size=1000, echo=print, **options):
+        """Rewrite the documents of a model in one transaction."""
+        name = model.__tablename__
+        db.session.execute(search_documents.delete().where(
+            search_documents.c.index_name == name))
+        chunk = []
+        done = 0
+        for obj in model.indexing_query().order_by(model.id). \
+                yield_per(chunk_size):
+            chunk.append((name, obj.id, None, document(obj)))
+            if len(chunk) == chunk_size:
+                self.bulk(chunk)
+                done += len(chunk)
+                chunk = []
+        self.bulk(chunk)
+        db.session.commit()
+        bump_generations([name])
+        echo('{}: {} documents reindexed'.format(name, done + len(chunk)))
+
+
+def make_backend(app):
+    """Create the backend selected by SEARCH_BACKEND."""
+    if app.config['SEARCH_BACKEND'] == 'elasticsearch':
+        return ElasticsearchBackend(app.elasticsearch) \
+            if app.elasticsearch else None
+    if app.config['SEARCH_BACKEND'] == 'database':
+        return DatabaseBackend(app.config['SEARCH_TS_CONFIG'])
+    return None
+
+
+def is_transactional():
+    backend = current_app.search_backend
+    return backend is not None and backend.transactional
 
 
 def add_to_index(index, model):
-    if not current_app.elasticsearch:
+    if current_app.search_backend is None:
         return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, doc_type=index, id=model.id, body=payload)
+    current_app.search_backend.add(index, model.id, document(model))
+
+
+def bulk_index(actions):
+    """Apply (index, id, version, document) actions in one request.
+
+    A None document deletes the entry. Versions are external, so an action
+    older than what the index already holds is skipped. Returns whether each
+    action was applied or made redundant.
+    """
+    backend = current_app.search_backend
+    if backend is None or not actions:
+        return [True] * len(actions)
+    results = backend.bulk(actions)
+    changed = set(action[0] for action, ok in zip(actions, results) if ok)
+    if backend.transactional:
+        # Bumped once the documents are committed, see search_after_commit.
+        db.session.info.setdefault('changed_indexes', set()).update(changed)
+    else:
+        bump_generations(changed)
+    return results
 
 
 def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+    if current_app.search_backend is None:
+        return
+    current_app.search_backend.remove(index, model.id)
+
+
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+
+def decode_cursor(cursor):
+    """Return the [score, id] position encoded in a search cursor.
+
+    Elasticsearch scores are numbers, database ranks are decimal strings.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise InvalidCursor
+    if not isinstance(values, list) or len(values) != 2 or \
+            not isinstance(values[0], (numbers.Real, str)) or \
+            not isinstance(values[1], (int, str)):
+        raise InvalidCursor
+    return values
+
+
+def _generation_key(index):
+    return 'search:generation:' + index
+
+
+def _cache_key(index, generation, query, per_page, page):
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+    return 'search:{}:{}:{}:{}:{}'.format(index, generation, digest,
+                                          per_page, page)
+
+
+def _cached_page(index, query, per_page, page):
+    """Return the cache key of a page of results and its cached entry."""
+    try:
+        generation = int(current_app.redis.get(_generation_key(index)) or 0)
+        key = _cache_key(index, generation, query, per_page, page)
+        data = current_app.redis.get(key)
+    except RedisError:
+        return None, None
+    return key, json.loads(data.decode('utf-8')) if data else None
+
+
+def bump_generations(indexes):
+    """Make the cached results of changed indexes unreachable.
+
+    Entries are keyed by the generation of their index, so they need not be
+    deleted and a page computed before a change can not be cached after it.
+    """
+    if not indexes or not current_app.config['SEARCH_CACHE']:
         return
-    current_app.elasticsearch.delete(index=index, doc_type=index, id=model.id)
-
-
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
-        return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        doc_type=index,
-        body={'query': {'multi_match': {'query': query, 'fields': ['*']}},
-              'from': (page - 1) * per_page,
-              'size': per_page})
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        for index in indexes:
+            pipe.incr(_generation_key(index))
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Search cache invalidation failed',
+                                   exc_info=True)
+
+
+def query_index(index, query, fields, per_page, page=1, after=None):
+    """Return a page of (id, source) hits and the cursor of the next one.
+
+    Pages follow each other with search_after cursors, so deep pages cost
+    the same as the first. Pages after the first need the cursor they are
+    reached with, see page_cursor(). The source is None for documents stored
+    without one, the cursor is None on the last page.
+    """
+    if page > 1 and after is None:
+        raise InvalidCursor
+    backend = current_app.search_backend
+    if backend is None:
+        return [], None
+    query = normalize(query)
+    key = entry = None
+    if current_app.config['SEARCH_CACHE']:
+        key, entry = _cached_page(index, query, per_page, page)
+    if entry is not None and entry['after'] == after:
+        return [tuple(hit) for hit in entry['hits']], entry['next']
+    hits, position = backend.query(index, query, fields, per_page,
+                                   decode_cursor(after) if after else None)
+    cursor = encode_cursor(position) if position else None
+    if key is not None:
+        try:
+            current_app.redis.set(key, json.dumps(
+                {'after': after, 'hits': hits, 'next': cursor}),
+                ex=current_app.config['SEARCH_CACHE_TTL'])
+        except RedisError:
+            pass
+    return hits, cursor
+
+
+def page_cursor(index, query, per_page, page):
+    """Return the cursor a cached page of results was reached with.
+
+    Cursors only lead forward, this is how earlier pages are found again.
+    The first page needs no cursor, None is returned when it is not known.
+    """
+    if page < 2 or not current_app.config['SEARCH_CACHE']:
+        return None
+    _, entry = _cached_page(index, normalize(query), per_page, page)
+    return entry['after'] if entry else None
+
+
+def reindex_model(model, **options):
+    if current_app.search_backend is not None:
+        current_app.search_backend.reindex(model, **options)
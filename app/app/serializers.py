@@ -0,0 +1,111 @@
+from flask import url_for
+from werkzeug.exceptions import BadRequest
+
+
+# URL arguments are built with these values and swapped for row values later.
+_PLACEHOLDER = 1000000000
+
+
+class InvalidFields(BadRequest):
+    description = 'unknown field or expansion requested'
+
+
+class InvalidIds(BadRequest):
+    description = 'ids must be a comma separated list of at most 100 integers'
+
+
+def parse_fields(value):
+    """Split a comma separated ?fields= or ?expand= argument."""
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()] \
+        or None
+
+
+def parse_ids(value, limit=100):
+    """Split a comma separated ?ids= argument, dropping duplicates."""
+    try:
+        ids = [int(id) for id in (value or '').split(',') if id.strip()]
+    except ValueError:
+        raise InvalidIds
+    if not ids or len(ids) > limit:
+        raise InvalidIds
+    return sorted(set(ids), key=ids.index)
+
+
+class UrlTemplate(object):
+    """A URL resolved once with url_for() and then filled for each row.
+
+    `fields` maps integer URL arguments of the endpoint to row attributes.
+    """
+
+    def __init__(self, endpoint, **fields):
+        args = sorted(fields)
+        url = url_for(endpoint, **{arg: _PLACEHOLDER + i
+                                   for i, arg in enumerate(args)})
+        url = url.replace('{', '{{').replace('}', '}}')
+        for i, arg in enumerate(args):
+            url = url.replace(str(_PLACEHOLDER + i), '{%d}' % i)
+        self.template = url
+        self.attrs = [fields[arg] for arg in args]
+
+    def __call__(self, row):
+        return self.template.format(*[getattr(row, attr)
+                                      for attr in self.attrs])
+
+
+class Serializer(object):
+    """Serialize rows field by field, selecting only the needed columns.
+
+    `fields` is a list of (name, column names, getter) tuples. The __keyset__
+    columns of the model are always selected for pagination. `expansions`
+    maps names to (attribute, loader) pairs, where loader receives a set of
+    attribute values and returns the embedded documents by value. `overlays`
+    are loaded the same way and replace the serialized value of a field for
+    the rows the loader returns a value for. `only` and `expand` are the
+    names requested by the client.
+
+    Rows can be result tuples of query.with_entities(*columns) or model
+    instances, getters only read attributes.
+    """
+
+    def __init__(self, model, fields, expansions=None, only=None,
+                 expand=None, overlays=None):
+        expansions = expansions or {}
+        overlays = overlays or {}
+        names = [name for name, _, _ in fields]
+        if any(name not in names for name in only or ()) or \
+                any(name not in expansions for name in expand or ()):
+            raise InvalidFields
+        self.fields = [(name, getter) for name, _, getter in fields
+                       if only is None or name in only]
+        self.expansions = [(name,) + expansions[name]
+                           for name in expand or ()]
+        self.overlays = [(name,) + overlays[name] for name, _ in self.fields
+                         if name in overlays]
+        keys = list(model.__keyset__)
+        for name, needed, _ in fields:
+            if only is None or name in only:
+                keys.extend(needed)
+        keys.extend(attr for _, attr, _ in self.expansions + self.overlays)
+        self.columns = [getattr(model, key) for i, key in enumerate(keys)
+                        if key not in keys[:i]]
+
+    def __call__(self, row):
+        return {name: getter(row) for name, getter in self.fields}
+
+    def serialize(self, rows):
+        """Serialize many rows, loading each expansion and overlay once."""
+        items = [self(row) for row in rows]
+        for name, attr, loader in self.overlays:
+            values = loader(set(getattr(row, attr) for row in rows)) \
+                if rows else {}
+            for item, row in zip(items, rows):
+                if getattr(row, attr) in values:
+                    item[name] = values[getattr(row, attr)]
+        for name, attr, loader in self.expansions:
+            values = set(getattr(row, attr) for row in rows)
+            embedded = loader(values) if values else {}
+            for item, row in zip(items, rows):
+                item[name] = embedded.get(getattr(row, attr))
+        return items
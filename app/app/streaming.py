@@ -0,0 +1,58 @@
+import json
+import zlib
+
+from flask import Response, request, stream_with_context
+
+from app.pagination import keyset
+
+
+NDJSON_BATCH_SIZE = 1000
+
+
+def iter_ndjson(query, serializer, batch_size=NDJSON_BATCH_SIZE):
+    """Yield every row of a query as newline delimited JSON, in batches.
+
+    yield_per() runs the query on a server-side cursor, so only one batch of
+    rows is held in memory. Expansions are loaded once per batch.
+    """
+    rows = keyset(query.with_entities(*serializer.columns)).yield_per(
+        batch_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield _dump(serializer.serialize(batch))
+            batch = []
+    if batch:
+        yield _dump(serializer.serialize(batch))
+
+
+def _dump(items):
+    return ''.join(json.dumps(item) + '\n' for item in items).encode('utf-8')
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        # A sync flush per batch lets clients decode rows as they arrive.
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def ndjson_response(query, serializer):
+    """Stream a query as an application/x-ndjson response.
+
+    The body is gzip encoded when the client accepts it, unless it asks for
+    an identity body with ?gzip=0.
+    """
+    chunks = iter_ndjson(query, serializer)
+    compress = request.args.get('gzip', 1, type=int) != 0 and \
+        'gzip' in request.accept_encodings
+    if compress:
+        chunks = _gzip(chunks)
+    response = Response(stream_with_context(chunks),
+                        mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,84 @@
+"""Username prefix index for typeahead suggestions.
+
+Every user is a member `<lowercase username>\\0<username>\\0<id>` of one
+sorted set where all scores are 0, so the members are ordered by their bytes
+and ZRANGEBYLEX returns the usernames starting with a prefix in
+O(log(N) + limit), without touching the database.
+"""
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+SUGGEST_KEY = 'users:suggest'
+
+
+def _enabled():
+    return current_app.config['USERNAME_SUGGEST']
+
+
+def _member(user_id, username):
+    return '{}\0{}\0{}'.format(username.lower(), username, user_id)
+
+
+def update_suggestions(added=(), removed=()):
+    """Apply (id, username) pairs added to and removed from the index."""
+    if not _enabled() or not (added or removed):
+        return
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        if removed:
+            pipe.zrem(SUGGEST_KEY, *[_member(*pair) for pair in removed])
+        for pair in added:
+            pipe.execute_command('ZADD', SUGGEST_KEY, 0, _member(*pair))
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Username suggestion update failed',
+                                   exc_info=True)
+
+
+def suggest_usernames(prefix, limit):
+    """Return up to `limit` (id, username) pairs starting with `prefix`.
+
+    Matching is case insensitive. An empty list is returned while Redis is
+    unavailable, rather than scanning the user table.
+    """
+    prefix = prefix.strip().lower()
+    if not _enabled() or not prefix or '\0' in prefix:
+        return []
+    start = prefix.encode('utf-8')
+    try:
+        members = current_app.redis.zrangebylex(
+            SUGGEST_KEY, b'[' + start, b'[' + start + b'\xff', 0, limit)
+    except RedisError:
+        current_app.logger.warning('Username suggestion failed',
+                                   exc_info=True)
+        return []
+    pairs = []
+    for member in members:
+        _, username, user_id = member.decode('utf-8').split('\0')
+        pairs.append((int(user_id), username))
+    return pairs
+
+
+def rebuild_suggestions(pairs, chunk_size=5000):
+    """Replace the index with (id, username) pairs streamed from the table.
+
+    The index is built under a temporary key and renamed over the live one,
+    so suggestions keep working while it is rebuilt.
+    """
+    building = SUGGEST_KEY + ':building'
+    redis = current_app.redis
+    redis.delete(building)
+    count = 0
+    pipe = redis.pipeline(transaction=False)
+    for pair in pairs:
+        pipe.execute_command('ZADD', building, 0, _member(*pair))
+        count += 1
+        if count % chunk_size == 0:
+            pipe.execute()
+    pipe.execute()
+    if count:
+        redis.rename(building, SUGGEST_KEY)
+    else:
+        redis.delete(SUGGEST_KEY)
+    return count
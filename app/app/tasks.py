@@ -35,7 +35,7 @@ def _set_task_progress(progress):
 def export_posts(user_id):
     try:
         user = User.query.get(user_id)
-        total_posts = user.posts.count()
+        total_posts = user.post_count
         if total_posts > 0:
             _set_task_progress(0)
             data = []
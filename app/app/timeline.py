@@ -0,0 +1,170 @@
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+EPOCH = datetime(1970, 1, 1)
+CELEBRITIES_KEY = 'timeline:celebrities'
+# Member with a score of -inf kept at the bottom of a timeline for as long as
+# the timeline holds every post of the feed. Trimming removes it first, so its
+# absence means older posts have to be read from the database.
+SENTINEL = 0
+
+_PUSH_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    for i = 1, #ARGV - 1, 2 do
+        redis.call('zadd', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('zremrangebyrank', KEYS[1], 0, -tonumber(ARGV[#ARGV]) - 1)
+end
+"""
+
+
+def timeline_key(user_id):
+    return 'timeline:{}'.format(user_id)
+
+
+def score(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _enabled():
+    return current_app.config['TIMELINE_CACHE']
+
+
+def add_to_timelines(user_ids, entries):
+    """Push (post_id, timestamp) entries to the cached timelines of users.
+
+    Timelines that are not cached are left alone, they are rebuilt from the
+    database on the next read.
+    """
+    if not _enabled() or not user_ids or not entries:
+        return
+    args = []
+    for post_id, timestamp in entries:
+        args.extend([score(timestamp), post_id])
+    args.append(current_app.config['TIMELINE_LENGTH'])
+    try:
+        push = current_app.redis.register_script(_PUSH_SCRIPT)
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            push(keys=[timeline_key(user_id)], args=args, client=pipe)
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Timeline push failed', exc_info=True)
+
+
+def remove_from_timelines(user_ids, post_ids):
+    if not _enabled() or not user_ids or not post_ids:
+        return
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zrem(timeline_key(user_id), *post_ids)
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Timeline prune failed', exc_info=True)
+
+
+def read_timeline(user_id, count, after=None, before=None):
+    """Return up to `count` entries of a cached timeline.
+
+    `after` and `before` are (timestamp, post_id) keyset values. Entries are
+    returned newest first, or oldest first when reading before a cursor, as
+    a ([(post_id, score), ...], complete) tuple where complete tells that the
+    cache holds every post of the feed in that direction. None is returned
+    when the timeline is not cached.
+    """
+    if not _enabled():
+        return None
+    key = timeline_key(user_id)
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.expire(key, current_app.config['TIMELINE_TTL'])
+        if before is not None:
+            bound = score(before[0])
+            pipe.zcount(key, bound, bound)
+            pipe.zrange(key, 0, 0, withscores=True)
+        elif after is not None:
+            bound = score(after[0])
+            pipe.zcount(key, bound, bound)
+        else:
+            pipe.zrevrange(key, 0, count, withscores=True)
+        result = pipe.execute()
+        if not result[0]:
+            return None
+        if before is not None:
+            ties, lowest = result[2:]
+            rows = current_app.redis.zrangebyscore(
+                key, bound, '+inf', start=0, num=count + ties,
+                withscores=True)
+        elif after is not None:
+            rows = current_app.redis.zrevrangebyscore(
+                key, bound, '-inf', start=0, num=count + 1 + result[2],
+                withscores=True)
+        else:
+            rows = result[2]
+    except RedisError:
+        return None
+    entries = [(int(member), value) for member, value in rows]
+    if before is not None:
+        if int(lowest[0][0]) != SENTINEL and lowest[0][1] > bound:
+            return [], False
+        entries = sorted((e for e in entries
+                          if (e[1], e[0]) > (bound, before[1])),
+                         key=lambda e: (e[1], e[0]))
+        return entries[:count], True
+    complete = bool(entries) and entries[-1][0] == SENTINEL
+    if complete:
+        entries.pop()
+    if after is not None:
+        entries = sorted((e for e in entries
+                          if (e[1], e[0]) < (bound, after[1])),
+                         key=lambda e: (e[1], e[0]), reverse=True)
+    return entries[:count], complete
+
+
+def cache_timeline(user_id, entries, complete):
+    if not _enabled():
+        return
+    key = timeline_key(user_id)
+    args = []
+    for post_id, timestamp in entries:
+        args.extend([score(timestamp), post_id])
+    if complete:
+        args.extend(['-inf', SENTINEL])
+    if not args:
+        return
+    try:
+        pipe = current_app.redis.pipeline()
+        pipe.delete(key)
+        pipe.execute_command('ZADD', key, *args)
+        pipe.expire(key, current_app.config['TIMELINE_TTL'])
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Timeline rebuild failed', exc_info=True)
+
+
+def set_celebrity(user_id, celebrity):
+    """Track users whose posts are pulled on read instead of fanned out."""
+    if not _enabled():
+        return
+    try:
+        if celebrity:
+            current_app.redis.sadd(CELEBRITIES_KEY, user_id)
+        else:
+            current_app.redis.srem(CELEBRITIES_KEY, user_id)
+    except RedisError:
+        pass
+
+
+def get_celebrities():
+    if not _enabled():
+        return []
+    try:
+        return [int(user_id) for user_id in
+                current_app.redis.smembers(CELEBRITIES_KEY)]
+    except RedisError:
+        return []
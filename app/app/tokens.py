@@ -0,0 +1,136 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+import jwt
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.cache import LocalCache, invalidate, start_listener
+
+
+REVOKED_KEY = 'tokens:revoked'
+
+_local_tokens = LocalCache('token')
+
+
+def _digest(token):
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+def _redis_key(digest):
+    return 'token:' + digest
+
+
+def _enabled():
+    return current_app.config['TOKEN_CACHE']
+
+
+def get_cached_token(token):
+    """Return the (user_id, expiration) of a token, or None on a miss.
+
+    The local cache of the process is read first, then Redis.
+    """
+    if not _enabled():
+        return None
+    start_listener()
+    digest = _digest(token)
+    cached = _local_tokens.get(digest)
+    if cached is not None:
+        return cached
+    try:
+        value = current_app.redis.get(_redis_key(digest))
+    except RedisError:
+        return None
+    if value is None:
+        return None
+    user_id, expiration = value.decode('utf-8').split(':')
+    cached = int(user_id), datetime.utcfromtimestamp(float(expiration))
+    _local_tokens.set(digest, cached,
+                      current_app.config['TOKEN_CACHE_LOCAL_TTL'])
+    return cached
+
+
+def cache_token(token, user_id, expiration):
+    if not _enabled():
+        return
+    ttl = int((expiration - datetime.utcnow()).total_seconds())
+    if ttl <= 0:
+        return
+    digest = _digest(token)
+    _local_tokens.set(digest, (user_id, expiration),
+                      min(ttl, current_app.config['TOKEN_CACHE_LOCAL_TTL']))
+    value = '{}:{}'.format(
+        user_id, (expiration - datetime(1970, 1, 1)).total_seconds())
+    ttl = min(ttl, current_app.config['TOKEN_CACHE_TTL'])
+    try:
+        current_app.redis.set(_redis_key(digest), value, ex=ttl)
+    except RedisError:
+        pass
+
+
+def invalidate_tokens(tokens):
+    """Forget tokens in Redis and in the local cache of every worker."""
+    if not _enabled() or not tokens:
+        return
+    digests = [_digest(token) for token in tokens]
+    try:
+        current_app.redis.delete(*[_redis_key(digest) for digest in digests])
+    except RedisError:
+        current_app.logger.warning('Token invalidation failed', exc_info=True)
+    invalidate(_local_tokens, digests)
+
+
+def encode_token(user_id, kind):
+    """Issue a signed access or refresh token of a user.
+
+    Returns the token and its expiration.
+    """
+    ttl = current_app.config[
+        'ACCESS_TOKEN_TTL' if kind == 'access' else 'REFRESH_TOKEN_TTL']
+    now = datetime.utcnow()
+    expiration = now + timedelta(seconds=ttl)
+    token = jwt.encode(
+        {'sub': user_id, 'type': kind, 'jti': uuid.uuid4().hex,
+         'iat': now, 'exp': expiration},
+        current_app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+    return token, expiration
+
+
+def decode_token(token, kind):
+    """Return the claims of a valid, unrevoked signed token, or None.
+
+    Only the revocation set is read. When Redis is unavailable tokens are
+    rejected, unless TOKEN_REVOCATION_FAIL_OPEN lets access tokens through,
+    their short lifetime then bounds the exposure.
+    """
+    try:
+        claims = jwt.decode(token, current_app.config['SECRET_KEY'],
+                            algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    if claims.get('type') != kind:
+        return None
+    try:
+        if current_app.redis.zscore(REVOKED_KEY, claims['jti']) is not None:
+            return None
+    except RedisError:
+        current_app.logger.warning('Token revocation check failed',
+                                   exc_info=True)
+        if kind != 'access' or \
+                not current_app.config['TOKEN_REVOCATION_FAIL_OPEN']:
+            return None
+    return claims
+
+
+def revoke_jti(jti, exp):
+    """Add the id of a signed token to the revocation set until it expires.
+
+    Entries are scored by expiration, expired ones are pruned on each
+    revocation to keep the set small.
+    """
+    now = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+    pipe = current_app.redis.pipeline()
+    pipe.execute_command('ZADD', REVOKED_KEY, exp, jti)
+    pipe.zremrangebyscore(REVOKED_KEY, '-inf', now)
+    pipe.execute()
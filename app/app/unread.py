@@ -0,0 +1,107 @@
+"""Unread message counters kept in Redis.
+
+The message table stays the source of truth: a missing counter is filled
+from a COUNT, counters expire after UNREAD_COUNTER_TTL seconds, and
+`flask messages reconcile --loop` corrects the ones that drifted every
+UNREAD_RECONCILE_INTERVAL seconds.
+"""
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+# Only counters that exist are incremented, a missing one is counted again.
+_INCR_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+"""
+
+
+def _enabled():
+    return current_app.config['UNREAD_COUNTER']
+
+
+def unread_key(user_id):
+    return 'unread:{}'.format(user_id)
+
+
+def get_unread(user_id):
+    """Return the counter of a user, or None when it is not known."""
+    if not _enabled():
+        return None
+    try:
+        value = current_app.redis.get(unread_key(user_id))
+    except RedisError:
+        return None
+    return int(value) if value is not None else None
+
+
+def fill_unread(user_id, count):
+    """Store a counted value, unless a counter was set meanwhile."""
+    if not _enabled():
+        return
+    try:
+        current_app.redis.set(unread_key(user_id), count, nx=True,
+                              ex=current_app.config['UNREAD_COUNTER_TTL'])
+    except RedisError:
+        pass
+
+
+def update_unread(received, read):
+    """Apply committed changes to the counters.
+
+    `received` maps recipient ids to their number of new messages, `read`
+    lists the users who have just read their messages.
+    """
+    if not _enabled() or not (received or read):
+        return
+    ttl = current_app.config['UNREAD_COUNTER_TTL']
+    try:
+        incr = current_app.redis.register_script(_INCR_SCRIPT)
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id in read:
+            pipe.set(unread_key(user_id), received.get(user_id, 0), ex=ttl)
+        for user_id, count in received.items():
+            if user_id not in read:
+                incr(keys=[unread_key(user_id)], args=[count], client=pipe)
+        pipe.execute()
+    except RedisError:
+        current_app.logger.warning('Unread counter update failed',
+                                   exc_info=True)
+        # Counted again on the next read instead of staying wrong.
+        try:
+            current_app.redis.delete(*[unread_key(user_id) for user_id in
+                                       set(received) | set(read)])
+        except RedisError:
+            pass
+
+
+def counted_users(batch_size=1000):
+    """Yield lists of the ids of users that have a counter."""
+    batch = []
+    for key in current_app.redis.scan_iter('unread:*', count=batch_size):
+        batch.append(int(key.decode('utf-8').split(':', 1)[1]))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def correct_unread(counts):
+    """Overwrite existing counters with {user_id: count} from the database.
+
+    Returns the number of counters that were wrong.
+    """
+    pipe = current_app.redis.pipeline(transaction=False)
+    for user_id in counts:
+        pipe.get(unread_key(user_id))
+    values = pipe.execute()
+    ttl = current_app.config['UNREAD_COUNTER_TTL']
+    wrong = 0
+    for (user_id, count), value in zip(counts.items(), values):
+        if value is not None and int(value) != count:
+            pipe.set(unread_key(user_id), count, ex=ttl, xx=True)
+            wrong += 1
+    pipe.execute()
+    return wrong
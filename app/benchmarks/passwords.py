@@ -0,0 +1,30 @@
+"""Measure password verifications per second at several hashing costs.
+
+Run from the app directory with `python -m benchmarks.passwords`. One thread
+verifies hashes back to back, so the rate is per core; multiply it by
+PASSWORD_HASH_WORKERS to size the login capacity of a process.
+"""
+import timeit
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+METHODS = ['pbkdf2:sha256:50000', 'pbkdf2:sha256:150000',
+           'pbkdf2:sha256:260000', 'pbkdf2:sha512:150000']
+PASSWORD = 'correct horse battery staple'
+NUMBER = 5
+REPEAT = 3
+
+
+def main():
+    for method in METHODS:
+        password_hash = generate_password_hash(PASSWORD, method, 16)
+        seconds = min(timeit.repeat(
+            lambda: check_password_hash(password_hash, PASSWORD),
+            number=NUMBER, repeat=REPEAT)) / NUMBER
+        print('{:<28} {:>8.1f} ms {:>8.1f} logins/s per core'.format(
+            method, seconds * 1000, 1 / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Compare the compiled serializers with to_dict() and PostSchema.
+
+Run from the app directory with `python -m benchmarks.serializers`. Rows are
+built in memory, so no database is needed.
+"""
+import timeit
+from datetime import datetime
+
+from app import create_app
+from app.api.schemas import PostSchema
+from app.models import Post, User
+from config import Config
+
+
+ITEMS = 100
+REPEAT = 50
+
+
+def bench(name, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print('{:<28} {:>8.2f} ms per {} items'.format(
+        name, seconds * 1000, ITEMS))
+    return seconds
+
+
+def main():
+    app = create_app(Config)
+    with app.test_request_context():
+        now = datetime.utcnow()
+        posts = [Post(id=i, body='post {}'.format(i), timestamp=now,
+                      user_id=i % 10 + 1, language='en')
+                 for i in range(1, ITEMS + 1)]
+        users = [User(id=i, username='user{}'.format(i),
+                      email='user{}@example.com'.format(i), last_seen=now,
+                      about_me='about', post_count=i, follower_count=i,
+                      followed_count=i)
+                 for i in range(1, ITEMS + 1)]
+        schema = PostSchema()
+        assert [Post.serializer()(post) for post in posts] == \
+            [post.to_dict() for post in posts]
+        assert [User.serializer()(user) for user in users] == \
+            [user.to_dict() for user in users]
+
+        slow = bench('Post.to_dict', lambda: [p.to_dict() for p in posts])
+        bench('PostSchema.dump', lambda: [schema.dump(p) for p in posts])
+
+        def compiled_posts():
+            serializer = Post.serializer()
+            return [serializer(p) for p in posts]
+        fast = bench('Post.serializer', compiled_posts)
+        print('{:<28} {:>8.1f}x'.format('speedup', slow / fast))
+
+        slow = bench('User.to_dict', lambda: [u.to_dict() for u in users])
+
+        def compiled_users():
+            serializer = User.serializer()
+            return [serializer(u) for u in users]
+        fast = bench('User.serializer', compiled_users)
+        print('{:<28} {:>8.1f}x'.format('speedup', slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,10 +18,80 @@ class BaseConfig(object):
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['admin@example.com']
     POSTS_PER_PAGE = 25
+    POST_BATCH_LIMIT = int(os.environ.get('POST_BATCH_LIMIT') or 1000)
     LANGUAGES = ['en', 'es', 'ru']
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
 
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    # 'elasticsearch', or 'database' for PostgreSQL full-text search.
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or \
+        ('elasticsearch' if ELASTICSEARCH_URL else 'database')
+    SEARCH_TS_CONFIG = os.environ.get('SEARCH_TS_CONFIG') or 'simple'
+    # Store what search results render in the index, see `flask search
+    # reindex` to fill it for documents indexed before.
+    SEARCH_STORE_SOURCE = True
+    SEARCH_CACHE = True
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL') or 60)
+    SEARCH_OUTBOX_BATCH = int(os.environ.get('SEARCH_OUTBOX_BATCH') or 500)
+    SEARCH_OUTBOX_MAX_BACKOFF = 3600
+    SEARCH_OUTBOX_POLL_INTERVAL = 1
+    SEARCH_INDEX_REPLICAS = int(os.environ.get('SEARCH_INDEX_REPLICAS') or 1)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
 
+    TIMELINE_CACHE = True
+    TIMELINE_LENGTH = int(os.environ.get('TIMELINE_LENGTH') or 800)
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 5000)
+    TIMELINE_TTL = 7 * 24 * 3600
+
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 60)
+    COUNT_ESTIMATE_THRESHOLD = 10000
+
+    USER_CACHE = True
+    USERNAME_SUGGEST = True
+    USERNAME_SUGGEST_LIMIT = 10
+    USER_CACHE_LOCAL_TTL = int(os.environ.get('USER_CACHE_LOCAL_TTL') or 30)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+
+    # A werkzeug method, 'pbkdf2:<hash>:<iterations>'. Stored hashes made
+    # with other parameters are replaced on the next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or \
+        'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or
+                                os.cpu_count() or 1)
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 16)
+
+    LAST_SEEN_BUFFER = True
+    LAST_SEEN_FLUSH_INTERVAL = int(
+        os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+
+    # 'opaque' tokens are stored on the user row, 'jwt' tokens are signed.
+    TOKEN_MODE = os.environ.get('TOKEN_MODE') or 'opaque'
+    ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL') or 900)
+    REFRESH_TOKEN_TTL = int(os.environ.get('REFRESH_TOKEN_TTL') or
+                            14 * 24 * 3600)
+    # Accept access tokens whose revocation cannot be checked.
+    TOKEN_REVOCATION_FAIL_OPEN = \
+        os.environ.get('TOKEN_REVOCATION_FAIL_OPEN') is not None
+    TOKEN_CACHE = True
+    TOKEN_CACHE_LOCAL_TTL = int(os.environ.get('TOKEN_CACHE_LOCAL_TTL') or 10)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 300)
+
+    UNREAD_COUNTER = True
+    UNREAD_COUNTER_TTL = 24 * 3600
+    UNREAD_RECONCILE_INTERVAL = int(
+        os.environ.get('UNREAD_RECONCILE_INTERVAL') or 3600)
+
+    NOTIFICATION_STORE = True
+    NOTIFICATION_STORE_TTL = 30 * 24 * 3600
+    NOTIFICATION_PERSIST = True
+    NOTIFICATION_PERSIST_INTERVAL = int(
+        os.environ.get('NOTIFICATION_PERSIST_INTERVAL') or 5)
+    # Each stream holds a worker, only set this where /notifications/stream
+    # is served by gevent workers, like the app-stream service.
+    NOTIFICATION_STREAM = os.environ.get('NOTIFICATION_STREAM') is not None
+    NOTIFICATION_STREAM_HEARTBEAT = 15
+    NOTIFICATION_STREAM_DURATION = int(
+        os.environ.get('NOTIFICATION_STREAM_DURATION') or 600)
+
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
@@ -6,4 +6,17 @@ from config.base import BaseConfig
 class Config(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL_TESTING')
+    REDIS_URL = os.environ.get('REDIS_URL_TESTING') or 'redis://localhost/15'
     ELASTICSEARCH_URL = None
+    SEARCH_BACKEND = 'database'
+    SEARCH_CACHE = False
+    TIMELINE_CACHE = False
+    COUNT_CACHE_TTL = 0
+    TOKEN_CACHE = False
+    LAST_SEEN_BUFFER = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    USER_CACHE = False
+    USERNAME_SUGGEST = False
+    NOTIFICATION_STORE = False
+    UNREAD_COUNTER = False
+    NOTIFICATION_STREAM = False
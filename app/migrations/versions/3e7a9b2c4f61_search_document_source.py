@@ -0,0 +1,25 @@
+"""search document source
+
+Revision ID: 3e7a9b2c4f61
+Revises: 9c3d5f1a7e20
+Create Date: 2026-10-18 16:41:19.207356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7a9b2c4f61'
+down_revision = '9c3d5f1a7e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('search_document', sa.Column('source', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('search_document', 'source')
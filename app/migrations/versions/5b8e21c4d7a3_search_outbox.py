@@ -0,0 +1,35 @@
+"""search outbox
+
+Revision ID: 5b8e21c4d7a3
+Revises: e4f09a6b3c12
+Create Date: 2026-10-18 15:21:07.530114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e21c4d7a3'
+down_revision = 'e4f09a6b3c12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_outbox',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('index_name', sa.String(length=64), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_search_outbox_next_attempt'), 'search_outbox', ['next_attempt'], unique=False)
+    op.create_index('ix_search_outbox_index_name_doc_id', 'search_outbox', ['index_name', 'doc_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_search_outbox_index_name_doc_id', table_name='search_outbox')
+    op.drop_index(op.f('ix_search_outbox_next_attempt'), table_name='search_outbox')
+    op.drop_table('search_outbox')
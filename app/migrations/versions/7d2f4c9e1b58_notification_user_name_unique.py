@@ -0,0 +1,28 @@
+"""notification user name unique
+
+Revision ID: 7d2f4c9e1b58
+Revises: 3e7a9b2c4f61
+Create Date: 2026-10-18 18:12:36.540981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f4c9e1b58'
+down_revision = '3e7a9b2c4f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the latest notification of each name, older ones are replaced.
+    op.execute("DELETE FROM notification n USING notification newer "
+               "WHERE n.user_id = newer.user_id AND n.name = newer.name "
+               "AND (n.timestamp, n.id) < (newer.timestamp, newer.id)")
+    op.create_unique_constraint('uq_notification_user_id_name', 'notification', ['user_id', 'name'])
+
+
+def downgrade():
+    op.drop_constraint('uq_notification_user_id_name', 'notification', type_='unique')
@@ -0,0 +1,35 @@
+"""search document
+
+Revision ID: 9c3d5f1a7e20
+Revises: 5b8e21c4d7a3
+Create Date: 2026-10-18 16:02:44.918273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3d5f1a7e20'
+down_revision = '5b8e21c4d7a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_document',
+    sa.Column('index_name', sa.String(length=64), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('vector', postgresql.TSVECTOR(), nullable=False),
+    sa.PrimaryKeyConstraint('index_name', 'doc_id')
+    )
+    op.create_index('ix_search_document_vector', 'search_document', ['vector'], unique=False, postgresql_using='gin')
+    op.execute("INSERT INTO search_document (index_name, doc_id, vector) "
+               "SELECT 'post', id, to_tsvector('simple', coalesce(body, '')) "
+               "FROM post")
+
+
+def downgrade():
+    op.drop_index('ix_search_document_vector', table_name='search_document')
+    op.drop_table('search_document')
@@ -0,0 +1,28 @@
+"""keyset pagination indexes
+
+Revision ID: a3c5d2e7f901
+Revises: 801300994945
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5d2e7f901'
+down_revision = '801300994945'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_post_timestamp_id', 'post', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_post_user_id_timestamp_id', 'post', ['user_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_message_recipient_id_timestamp_id', 'message', ['recipient_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_message_recipient_id_timestamp_id', table_name='message')
+    op.drop_index('ix_post_user_id_timestamp_id', table_name='post')
+    op.drop_index('ix_post_timestamp_id', table_name='post')
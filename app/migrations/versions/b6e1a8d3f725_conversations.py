@@ -0,0 +1,80 @@
+"""conversations and inbox
+
+Revision ID: b6e1a8d3f725
+Revises: 7d2f4c9e1b58
+Create Date: 2026-10-18 19:04:52.613097
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1a8d3f725'
+down_revision = '7d2f4c9e1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user1_id', sa.Integer(), nullable=False),
+    sa.Column('user2_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user1_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user2_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user1_id', 'user2_id', name='uq_conversation_user1_id_user2_id')
+    )
+    op.add_column('message', sa.Column('conversation_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(op.f('message_conversation_id_fkey'), 'message', 'conversation', ['conversation_id'], ['id'])
+    op.execute("INSERT INTO conversation (user1_id, user2_id, timestamp) "
+               "SELECT least(sender_id, recipient_id), "
+               "greatest(sender_id, recipient_id), min(timestamp) "
+               "FROM message "
+               "WHERE sender_id IS NOT NULL AND recipient_id IS NOT NULL "
+               "GROUP BY 1, 2")
+    op.execute("UPDATE message SET conversation_id = conversation.id "
+               "FROM conversation "
+               "WHERE conversation.user1_id = least(message.sender_id, message.recipient_id) "
+               "AND conversation.user2_id = greatest(message.sender_id, message.recipient_id)")
+    op.create_index('ix_message_conversation_id_timestamp_id', 'message', ['conversation_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_message_sender_id_timestamp_id', 'message', ['sender_id', 'timestamp', 'id'], unique=False)
+    op.create_table('inbox',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('other_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('body', sa.String(length=140), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['message_id'], ['message.id'], ),
+    sa.ForeignKeyConstraint(['other_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['sender_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'conversation_id')
+    )
+    op.create_index('ix_inbox_user_id_timestamp_conversation_id', 'inbox', ['user_id', 'timestamp', 'conversation_id'], unique=False)
+    op.execute("INSERT INTO inbox (user_id, conversation_id, other_id, "
+               "message_id, sender_id, body, timestamp) "
+               "SELECT DISTINCT ON (participant.user_id, m.conversation_id) "
+               "participant.user_id, m.conversation_id, participant.other_id, "
+               "m.id, m.sender_id, m.body, m.timestamp "
+               "FROM message m CROSS JOIN LATERAL (VALUES "
+               "(m.sender_id, m.recipient_id), (m.recipient_id, m.sender_id)"
+               ") AS participant (user_id, other_id) "
+               "WHERE m.conversation_id IS NOT NULL "
+               "ORDER BY participant.user_id, m.conversation_id, "
+               "m.timestamp DESC, m.id DESC")
+
+
+def downgrade():
+    op.drop_index('ix_inbox_user_id_timestamp_conversation_id', table_name='inbox')
+    op.drop_table('inbox')
+    op.drop_index('ix_message_sender_id_timestamp_id', table_name='message')
+    op.drop_index('ix_message_conversation_id_timestamp_id', table_name='message')
+    op.drop_constraint(op.f('message_conversation_id_fkey'), 'message', type_='foreignkey')
+    op.drop_column('message', 'conversation_id')
+    op.drop_table('conversation')
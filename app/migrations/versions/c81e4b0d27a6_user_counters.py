@@ -0,0 +1,36 @@
+"""user counters
+
+Revision ID: c81e4b0d27a6
+Revises: a3c5d2e7f901
+Create Date: 2026-10-18 11:40:07.552190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81e4b0d27a6'
+down_revision = 'a3c5d2e7f901'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE "user" SET '
+        'post_count = (SELECT count(*) FROM post '
+        'WHERE post.user_id = "user".id), '
+        'follower_count = (SELECT count(*) FROM followers '
+        'WHERE followers.followed_id = "user".id), '
+        'followed_count = (SELECT count(*) FROM followers '
+        'WHERE followers.follower_id = "user".id)')
+
+
+def downgrade():
+    op.drop_column('user', 'followed_count')
+    op.drop_column('user', 'follower_count')
+    op.drop_column('user', 'post_count')
@@ -0,0 +1,26 @@
+"""row versions
+
+Revision ID: e4f09a6b3c12
+Revises: c81e4b0d27a6
+Create Date: 2026-10-18 13:05:44.918273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4f09a6b3c12'
+down_revision = 'c81e4b0d27a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('post', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('post', 'version')
+    op.drop_column('user', 'version')
@@ -1 +1,28 @@
+import unittest
 
+from redis import Redis
+from redis.exceptions import ConnectionError, RedisError
+
+from config import Config
+
+
+def _redis_available():
+    try:
+        return Redis.from_url(Config.REDIS_URL).ping()
+    except RedisError:
+        return False
+
+
+# Tests of the Redis features run against the REDIS_URL_TESTING database,
+# which they flush.
+requires_redis = unittest.skipUnless(_redis_available(),
+                                     'Redis is not available')
+
+
+class UnavailableRedis(object):
+    """A Redis client whose every command fails, as during an outage."""
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise ConnectionError('Redis is unavailable')
+        return command
@@ -7,7 +7,9 @@ from flask_restful import url_for
 
 from app import create_app, db
 from app.models import User
+from app.tokens import decode_token, encode_token
 from config import Config
+from tests import UnavailableRedis, requires_redis
 
 
 class AuthAPITestCase(unittest.TestCase):
@@ -66,3 +68,52 @@ class AuthAPITestCase(unittest.TestCase):
         response = self.client.delete(
             url_for('api.tokens'), headers=self.user1_token_auth_headers)
         self.assertEqual(response.status_code, 204)
+
+    def test_revoke_cached_token(self):
+        self.app.config['TOKEN_CACHE'] = True
+        for _ in range(2):
+            response = self.client.get(
+                url_for('api.user_detail', user_id=self.user1.id),
+                headers=self.user1_token_auth_headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.delete(
+            url_for('api.tokens'), headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 401)
+
+    @requires_redis
+    def test_signed_tokens(self):
+        self.app.config['TOKEN_MODE'] = 'jwt'
+        response = self.client.post(
+            url_for('api.tokens'), headers=self.basic_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['user_id'], self.user1.id)
+        self.assertNotEqual(data['token'], self.user1_token)
+        self.assertIn('refresh_token', data)
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers={'Authorization': 'Bearer ' + data['token']})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers={'Authorization': 'Bearer ' + data['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_signed_tokens_without_redis(self):
+        access_token, _ = encode_token(self.user1.id, 'access')
+        refresh_token, _ = encode_token(self.user1.id, 'refresh')
+        self.app.redis = UnavailableRedis()
+        self.assertIsNone(decode_token(access_token, 'access'))
+        self.assertIsNone(decode_token(refresh_token, 'refresh'))
+        self.app.config['TOKEN_REVOCATION_FAIL_OPEN'] = True
+        self.assertEqual(decode_token(access_token, 'access')['sub'],
+                         self.user1.id)
+        self.assertIsNone(decode_token(refresh_token, 'refresh'))
@@ -42,6 +42,18 @@ class UserAPITestCase(unittest.TestCase):
             user_id=self.user1.id)
         self.assertEqual(data, data1)
 
+    def test_get_followers_stream(self):
+        self.user2.follow(self.user1)
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.follower_list_stream', user_id=self.user1.id),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [json.loads(line) for line in
+             response.get_data(as_text=True).splitlines()],
+            [self.user2.to_dict()])
+
     def test_get_followers_user_does_not_exists(self):
         response = self.client.get(
             url_for('api.follower_list', user_id=100),
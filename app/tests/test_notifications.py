@@ -0,0 +1,159 @@
+import json
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import create_app, db
+from app.models import Notification, User
+from app.notifications import _dispatch, _event, _streams, \
+    read_notifications, store_notifications, stream_notifications, \
+    take_dirty_users
+from config import Config
+from tests import UnavailableRedis, requires_redis
+
+
+class NotificationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_stream_notifications(self):
+        self.app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 0.05
+        stored = [{'name': 'a', 'data': 1, 'timestamp': 1.0},
+                  {'name': 'b', 'data': 2, 'timestamp': 2.0}]
+        reads = []
+
+        def backlog(since):
+            reads.append(since)
+            return [item for item in stored if item['timestamp'] > since]
+
+        with mock.patch('app.notifications._start_hub') as start_hub:
+            stream = stream_notifications(self.user1.id, 1.0, backlog)
+            self.assertEqual(next(stream), 'retry: 5000\n\n')
+            start_hub.assert_called_once_with()
+            self.assertEqual(next(stream), _event(stored[1]))
+            self.assertIn(self.user1.id, _streams)
+
+            published = {'name': 'c', 'data': 3, 'timestamp': 3.0}
+            _dispatch(self.user1.id, json.dumps(published))
+            self.assertEqual(next(stream), _event(published))
+
+            # Outdated messages are skipped, a lost subscription makes the
+            # stream read the backlog again.
+            stored.append({'name': 'd', 'data': 4, 'timestamp': 4.0})
+            _dispatch(self.user1.id, json.dumps(stored[1]))
+            _dispatch(self.user1.id, None)
+            self.assertEqual(next(stream), _event(stored[2]))
+            self.assertEqual(reads, [1.0, 3.0])
+
+            self.assertEqual(next(stream), ': keepalive\n\n')
+            stream.close()
+        self.assertNotIn(self.user1.id, _streams)
+
+    def test_stream_notifications_duration(self):
+        self.app.config['NOTIFICATION_STREAM_DURATION'] = 0
+        with mock.patch('app.notifications._start_hub'):
+            events = list(stream_notifications(
+                self.user1.id, 0.0, lambda since: []))
+        self.assertEqual(events, ['retry: 5000\n\n'])
+        self.assertNotIn(self.user1.id, _streams)
+
+
+@requires_redis
+class NotificationStoreCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app.config['NOTIFICATION_STORE'] = True
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        # Kept for tearDown, tests may replace the client of the app.
+        self.redis = self.app.redis
+        self.redis.flushdb()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        db.session.add(self.user1)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.redis.flushdb()
+        self.app_context.pop()
+
+    def stored(self, since=0.0):
+        return [(item['name'], item['payload_json'], item['timestamp'])
+                for item in read_notifications(self.user1.id, since)]
+
+    def test_store_replaces_older_items(self):
+        user_id = self.user1.id
+        store_notifications([(user_id, 'a', '1', 10.0)])
+        store_notifications([(user_id, 'a', '0', 5.0)])
+        self.assertEqual(self.stored(), [('a', '1', 10.0)])
+        store_notifications([(user_id, 'a', '2', 10.0),
+                             (user_id, 'b', '1', 11.0)])
+        self.assertEqual(self.stored(), [('a', '2', 10.0), ('b', '1', 11.0)])
+        store_notifications([(user_id, 'a', '3', 12.0)])
+        self.assertEqual(self.stored(), [('b', '1', 11.0), ('a', '3', 12.0)])
+
+    def test_since(self):
+        user_id = self.user1.id
+        store_notifications([(user_id, 'b', '2', 3.0),
+                             (user_id, 'a', '0', 1.0),
+                             (user_id, 'c', '1', 2.0)])
+        self.assertEqual(self.stored(1.0), [('c', '1', 2.0), ('b', '2', 3.0)])
+        self.assertEqual(self.stored(3.0), [])
+        self.assertEqual(
+            [n.name for n in Notification.since(user_id, 0.0)],
+            ['a', 'c', 'b'])
+        self.app.redis = UnavailableRedis()
+        self.assertEqual(Notification.since(user_id, 0.0), [])
+
+    def test_add_notification(self):
+        self.user1.add_notification('unread_message_count', 3)
+        db.session.commit()
+        notifications = Notification.since(self.user1.id)
+        self.assertEqual([(n.name, n.get_data()) for n in notifications],
+                         [('unread_message_count', 3)])
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(take_dirty_users(10), [self.user1.id])
+
+    def test_persist(self):
+        user_id = self.user1.id
+        db.session.add_all([
+            Notification(user_id=user_id, name='a', payload_json='0',
+                         timestamp=1.0),
+            Notification(user_id=user_id, name='b', payload_json='9',
+                         timestamp=100.0)])
+        db.session.commit()
+        store_notifications([(user_id, 'a', '1', 2.0),
+                             (user_id, 'b', '1', 3.0),
+                             (user_id, 'c', '1', 4.0)])
+        self.assertEqual(Notification.persist(), 1)
+        rows = Notification.query.order_by(Notification.name).all()
+        self.assertEqual([(n.name, n.payload_json, n.timestamp)
+                          for n in rows],
+                         [('a', '1', 2.0), ('b', '9', 100.0),
+                          ('c', '1', 4.0)])
+        self.assertEqual(Notification.persist(), 0)
+
+    def test_persist_failure(self):
+        store_notifications([(self.user1.id, 'a', '1', 2.0)])
+        with mock.patch.object(db.session, 'execute',
+                               side_effect=SQLAlchemyError('unavailable')):
+            with self.assertRaises(SQLAlchemyError):
+                Notification.persist()
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(Notification.persist(), 1)
+        self.assertEqual(Notification.query.count(), 1)
@@ -1,3 +1,4 @@
+import gzip
 import json
 from pprint import pprint
 import unittest
@@ -65,12 +66,136 @@ class PostAPITestCase(unittest.TestCase):
         for post in self.user1.posts.all():
             self.assertIn(post.to_dict(), data['items'])
 
+    def test_get_user_posts_cursor_links(self):
+        response = self.client.get(
+            url_for('api.post_list', user_id=self.user1.id, per_page=1),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['items'], [self.post2.to_dict()])
+        self.assertIsNone(data['_links']['prev'])
+        response = self.client.get(
+            data['_links']['next'], headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['items'], [self.post1.to_dict()])
+        self.assertIsNone(data['_links']['next'])
+        response = self.client.get(
+            data['_links']['prev'], headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['items'], [self.post2.to_dict()])
+        response = self.client.get(
+            url_for('api.post_list', user_id=self.user1.id, per_page=1,
+                    page=2),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['items'], [self.post1.to_dict()])
+
+    def test_get_user_posts_expand_author(self):
+        response = self.client.get(
+            url_for('api.post_list', user_id=self.user1.id,
+                    fields='id,body', expand='author'),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(
+            data['items'][0],
+            {'id': self.post2.id, 'body': self.post2.body,
+             'author': User.query.get(self.user1.id).to_dict()})
+
+    def test_get_user_posts_conditional(self):
+        url = url_for('api.post_list', user_id=self.user1.id)
+        response = self.client.get(url, headers=self.user1_token_auth_headers)
+        headers = dict(self.user1_token_auth_headers, **{
+            'If-None-Match': response.headers['ETag']})
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.post1.body = 'edited'
+        db.session.commit()
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_user_posts_error_on_invalid_cursor(self):
+        response = self.client.get(
+            url_for('api.post_list', user_id=self.user1.id, after='bogus'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_get_user_posts_error_on_user_does_not_exist(self):
         response = self.client.get(
             url_for('api.post_list', user_id=1000),
             headers=self.user1_token_auth_headers)
         self.assertEqual(response.status_code, 404)
 
+    def test_get_posts_by_ids(self):
+        ids = '{},1000,{}'.format(self.post2.id, self.post1.id)
+        response = self.client.get(
+            url_for('api.post_batch', ids=ids, expand='author'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([item['id'] for item in data['items']],
+                         [self.post2.id, self.post1.id])
+        self.assertEqual(data['items'][0]['author'], self.user1.to_dict())
+        self.assertEqual(data['_meta']['missing'], [1000])
+        response = self.client.get(
+            url_for('api.post_batch'), headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_user_posts_batch(self):
+        items = [{'body': 'batch post 1', 'language': 'en'},
+                 {'body': ''},
+                 {'body': 'batch post 2', 'user_id': self.user1.id}]
+        response = self.client.post(
+            url_for('api.post_list_batch', user_id=self.user1.id),
+            data=json.dumps(items), headers=self.user1_token_auth_headers,
+            content_type='application/json')
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual(data['_meta'], {'created': 2, 'failed': 1})
+        self.assertEqual([item['status'] for item in data['items']],
+                         [201, 400, 201])
+        post = Post.query.get(data['items'][2]['id'])
+        self.assertEqual(post.body, 'batch post 2')
+        self.assertEqual(post.author, self.user1)
+        self.assertEqual(self.user1.post_count, 4)
+        response = self.client.post(
+            url_for('api.post_list_batch', user_id=self.user1.id),
+            data='{"body": "ndjson post 1"}\n{"body": "ndjson post 2"}\n',
+            headers=self.user1_token_auth_headers,
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.user1.posts.count(), 6)
+
+    def test_create_user_posts_batch_errors(self):
+        url = url_for('api.post_list_batch', user_id=self.user1.id)
+        response = self.client.post(
+            url, data='{"body": "not a list"}',
+            headers=self.user1_token_auth_headers,
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url_for('api.post_list_batch', user_id=self.user2.id),
+            data=json.dumps([{'body': 'post'}]),
+            headers=self.user1_token_auth_headers,
+            content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(url, data=json.dumps([{'body': 'post'}]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_user_posts_stream(self):
+        url = url_for('api.post_list_stream', user_id=self.user1.id)
+        response = self.client.get(url, headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [self.post2.to_dict(), self.post1.to_dict()])
+        headers = dict(self.user1_token_auth_headers,
+                       **{'Accept-Encoding': 'gzip'})
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data).decode('utf-8'),
+                         '\n'.join(lines) + '\n')
+
     def test_get_user_posts_token_auth_required(self):
         response = self.client.get(
             url_for('api.post_list', user_id=self.user1.id))
@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import create_app, db
+from app.conditional import collection_etag
+from app.models import User
+from app.presence import buffered_last_seen, record_last_seen
+from config import Config
+from tests import requires_redis
+
+
+@requires_redis
+class PresenceCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app.config['LAST_SEEN_BUFFER'] = True
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        self.app.redis.flushdb()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+        self.now = datetime.utcnow().replace(microsecond=0) + \
+            timedelta(minutes=1)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app.redis.flushdb()
+        self.app_context.pop()
+
+    def test_buffer(self):
+        self.assertTrue(record_last_seen(self.user1.id, self.now))
+        later = self.now + timedelta(seconds=5)
+        self.assertTrue(record_last_seen(self.user1.id, later))
+        self.assertEqual(
+            buffered_last_seen([self.user1.id, self.user2.id]),
+            {self.user1.id: later})
+        self.assertEqual(self.user1.get_last_seen(), later)
+        self.assertEqual(self.user2.get_last_seen(), self.user2.last_seen)
+        self.app.config['LAST_SEEN_BUFFER'] = False
+        self.assertFalse(record_last_seen(self.user1.id, self.now))
+        self.assertEqual(buffered_last_seen([self.user1.id]), {})
+
+    def test_merge(self):
+        record_last_seen(self.user1.id, self.now)
+        user1, user2 = User.serializer().serialize([self.user1, self.user2])
+        self.assertEqual(user1['last_seen'], self.now.isoformat() + 'Z')
+        self.assertEqual(user2['last_seen'],
+                         self.user2.last_seen.isoformat() + 'Z')
+
+    def test_flush(self):
+        version = self.user1.version
+        record_last_seen(self.user1.id, self.now)
+        record_last_seen(self.user2.id, datetime(2000, 1, 1))
+        self.assertEqual(User.flush_last_seen(), 2)
+        self.assertEqual(buffered_last_seen([self.user1.id,
+                                             self.user2.id]), {})
+        db.session.expire_all()
+        self.assertEqual(self.user1.last_seen, self.now)
+        self.assertEqual(self.user1.version, version + 1)
+        # An older buffered time does not replace a newer one.
+        self.assertGreater(self.user2.last_seen, datetime(2000, 1, 1))
+        self.assertEqual(User.flush_last_seen(), 0)
+
+    def test_flush_failure(self):
+        later = self.now + timedelta(seconds=5)
+        record_last_seen(self.user1.id, self.now)
+        record_last_seen(self.user2.id, self.now)
+
+        def fail(*args, **kwargs):
+            # Recorded while the flush runs, kept over the restored time.
+            record_last_seen(self.user2.id, later)
+            raise SQLAlchemyError('database unavailable')
+
+        with mock.patch.object(db.session, 'execute', side_effect=fail):
+            with self.assertRaises(SQLAlchemyError):
+                User.flush_last_seen()
+        self.assertEqual(
+            buffered_last_seen([self.user1.id, self.user2.id]),
+            {self.user1.id: self.now, self.user2.id: later})
+
+    def test_collection_etag(self):
+        self.user1.follow(self.user2)
+        db.session.commit()
+
+        def etag():
+            return collection_etag(self.user2, self.user2.followers, 10,
+                                   overlay=buffered_last_seen)
+
+        before = etag()
+        self.assertEqual(etag(), before)
+        record_last_seen(self.user1.id, self.now)
+        self.assertNotEqual(etag(), before)
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import create_app, db
+from app.models import Post, User
+from app.reindex import reindex
+from config import Config
+
+
+class ReindexCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        self.posts = [Post(body='post {}'.format(i), author=self.user1,
+                           timestamp=now + timedelta(seconds=i))
+                      for i in range(5)]
+        db.session.add_all([self.user1] + self.posts)
+        db.session.commit()
+        self.es = mock.Mock()
+        self.app.elasticsearch = self.es
+        self.sent = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def send(self, body):
+        self.sent.append(body)
+        return len(body) // 2
+
+    def reindex(self, **options):
+        messages = []
+        # Chunks are sent from threads instead of processes holding clients.
+        with mock.patch('app.reindex.ProcessPoolExecutor',
+                        ThreadPoolExecutor), \
+                mock.patch('app.reindex._init_worker'), \
+                mock.patch('app.reindex._send', self.send):
+            reindex(Post, workers=1, chunk_size=2, echo=messages.append,
+                    **options)
+        return messages
+
+    def test_resume(self):
+        fd, checkpoint = tempfile.mkstemp(suffix='.json')
+        self.addCleanup(lambda: os.path.exists(checkpoint) and
+                        os.remove(checkpoint))
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'index': 'post-20261018150000',
+                       'last_id': self.posts[1].id, 'done': 2}, f)
+        self.es.indices.exists.return_value = True
+        self.es.indices.exists_alias.return_value = True
+        self.es.indices.get_alias.return_value = {
+            'post-20261001120000': {}, 'post-20261018150000': {}}
+        messages = self.reindex(checkpoint=checkpoint)
+        self.assertEqual(messages[0], 'Resuming post-20261018150000 after '
+                                      'id {}'.format(self.posts[1].id))
+        self.assertEqual(messages[-2], 'post-20261018150000: 5/5 documents '
+                                       '(100%)')
+        self.es.indices.create.assert_not_called()
+        actions = [action['index'] for body in self.sent
+                   for action in body[::2]]
+        self.assertEqual([action['_id'] for action in actions],
+                         [post.id for post in self.posts[2:]])
+        self.assertEqual(set(action['_index'] for action in actions),
+                         {'post-20261018150000'})
+        self.es.indices.update_aliases.assert_called_once_with(body={
+            'actions': [
+                {'remove': {'index': 'post-20261018150000',
+                            'alias': 'post-next'}},
+                {'add': {'index': 'post-20261018150000', 'alias': 'post'}},
+                {'remove': {'index': 'post-20261001120000',
+                            'alias': 'post'}}]})
+        self.es.indices.delete.assert_called_once_with(
+            index='post-20261001120000')
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_replace_index_without_alias(self):
+        self.es.indices.exists.side_effect = lambda index: index == 'post'
+        self.es.indices.exists_alias.return_value = False
+        self.reindex()
+        index = self.es.indices.create.call_args[1]['index']
+        self.es.indices.put_alias.assert_called_once_with(
+            index=index, name='post-next')
+        self.assertEqual(sum(len(body) // 2 for body in self.sent), 5)
+        calls = [name for name, _, _ in self.es.indices.mock_calls]
+        self.assertLess(calls.index('delete'), calls.index('update_aliases'))
+        self.es.indices.delete.assert_called_once_with(index='post')
+        self.es.indices.update_aliases.assert_called_once_with(body={
+            'actions': [{'remove': {'index': index, 'alias': 'post-next'}},
+                        {'add': {'index': index, 'alias': 'post'}}]})
@@ -0,0 +1,90 @@
+import unittest
+
+from app import create_app, db
+from app.models import User
+from app.suggest import SUGGEST_KEY, suggest_usernames
+from config import Config
+from tests import requires_redis
+
+
+@requires_redis
+class SuggestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app.config['USERNAME_SUGGEST'] = True
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        self.app.redis.flushdb()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='Johanna', email='johanna@example.com')
+        self.user3 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2, self.user3])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app.redis.flushdb()
+        self.app_context.pop()
+
+    def test_register(self):
+        self.assertEqual(suggest_usernames('jo', 10),
+                         [(self.user2.id, 'Johanna'), (self.user1.id, 'john')])
+        self.assertEqual(suggest_usernames('su', 10),
+                         [(self.user3.id, 'susan')])
+
+    def test_case_folding(self):
+        expected = [(self.user2.id, 'Johanna'), (self.user1.id, 'john')]
+        self.assertEqual(suggest_usernames('JO', 10), expected)
+        self.assertEqual(suggest_usernames(' jO ', 10), expected)
+        self.assertEqual(suggest_usernames('JOHA', 10), expected[:1])
+
+    def test_prefix_bounds(self):
+        user = User(username='joé', email='joe@example.com')
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(suggest_usernames('john', 10),
+                         [(self.user1.id, 'john')])
+        self.assertEqual(suggest_usernames('jo', 10),
+                         [(self.user2.id, 'Johanna'), (self.user1.id, 'john'),
+                          (user.id, 'joé')])
+        self.assertEqual(suggest_usernames('jo', 2),
+                         [(self.user2.id, 'Johanna'), (self.user1.id, 'john')])
+        self.assertEqual(suggest_usernames('johnny', 10), [])
+        self.assertEqual(suggest_usernames('jp', 10), [])
+        self.assertEqual(suggest_usernames('', 10), [])
+        self.assertEqual(suggest_usernames('jo\0', 10), [])
+
+    def test_rename(self):
+        self.user1.username = 'johnny'
+        db.session.commit()
+        self.assertEqual(suggest_usernames('john', 10),
+                         [(self.user1.id, 'johnny')])
+        self.user1.username = 'jack'
+        db.session.commit()
+        self.assertEqual(suggest_usernames('john', 10), [])
+        self.assertEqual(suggest_usernames('ja', 10),
+                         [(self.user1.id, 'jack')])
+
+    def test_delete(self):
+        db.session.delete(self.user3)
+        db.session.commit()
+        self.assertEqual(suggest_usernames('su', 10), [])
+
+    def test_rollback(self):
+        self.user1.username = 'jack'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(suggest_usernames('ja', 10), [])
+        self.assertEqual(suggest_usernames('john', 10),
+                         [(self.user1.id, 'john')])
+
+    def test_rebuild(self):
+        self.app.redis.delete(SUGGEST_KEY)
+        self.app.redis.execute_command('ZADD', SUGGEST_KEY, 0,
+                                       'zed\0zed\0999')
+        self.assertEqual(User.rebuild_suggestions(), 3)
+        self.assertEqual(suggest_usernames('ze', 10), [])
+        self.assertEqual(suggest_usernames('jo', 10),
+                         [(self.user2.id, 'Johanna'), (self.user1.id, 'john')])
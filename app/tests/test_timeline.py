@@ -0,0 +1,128 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Post, User
+from app.timeline import SENTINEL, get_celebrities, timeline_key
+from config import Config
+from tests import requires_redis
+
+
+@requires_redis
+class TimelineCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app.config['TIMELINE_CACHE'] = True
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        self.app.redis.flushdb()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+        self.now = datetime.utcnow()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app.redis.flushdb()
+        self.app_context.pop()
+
+    def add_posts(self, author, count):
+        posts = [Post(body='post {}'.format(i), author=author,
+                      timestamp=self.now + timedelta(seconds=i))
+                 for i in range(count)]
+        db.session.add_all(posts)
+        db.session.commit()
+        self.now += timedelta(seconds=count)
+        return posts
+
+    def cached_ids(self, user):
+        return [int(member) for member in self.app.redis.zrevrange(
+            timeline_key(user.id), 0, -1)]
+
+    def test_fanout(self):
+        self.user1.follow(self.user2)
+        db.session.commit()
+        self.assertEqual(self.user1.timeline(10).items, [])
+        self.assertEqual(self.cached_ids(self.user1), [SENTINEL])
+        post, = self.add_posts(self.user2, 1)
+        self.assertEqual(self.cached_ids(self.user1), [post.id, SENTINEL])
+        # Timelines that are not cached are rebuilt on read instead.
+        self.assertFalse(self.app.redis.exists(timeline_key(self.user2.id)))
+        self.assertEqual(self.user1.timeline(10).items, [post])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.cached_ids(self.user1), [SENTINEL])
+
+    def test_sentinel(self):
+        self.app.config['TIMELINE_LENGTH'] = 3
+        self.user1.follow(self.user2)
+        db.session.commit()
+        posts = self.add_posts(self.user2, 3)
+        self.assertEqual(self.user1.timeline(2).items, posts[:0:-1])
+        self.assertEqual(self.cached_ids(self.user1),
+                         [post.id for post in reversed(posts)] + [SENTINEL])
+        self.assertEqual(
+            self.app.redis.zscore(timeline_key(self.user1.id), SENTINEL),
+            float('-inf'))
+        page = self.user1.timeline(2)
+        self.assertEqual(self.user1.timeline(2, after=page.next_cursor).items,
+                         [posts[0]])
+
+    def test_backfill(self):
+        self.app.config['TIMELINE_LENGTH'] = 3
+        self.user1.follow(self.user2)
+        db.session.commit()
+        posts = self.add_posts(self.user2, 5)
+        self.app.redis.delete(timeline_key(self.user1.id))
+        page = self.user1.timeline(2)
+        self.assertEqual(page.items, posts[:2:-1])
+        # The rebuilt timeline lacks older posts, they are read from the
+        # database.
+        self.assertNotIn(SENTINEL, self.cached_ids(self.user1))
+        page = self.user1.timeline(2, after=page.next_cursor)
+        self.assertEqual(page.items, posts[2:0:-1])
+        page = self.user1.timeline(2, after=page.next_cursor)
+        self.assertEqual(page.items, [posts[0]])
+        self.assertFalse(page.has_next)
+
+    def test_follow_backfill(self):
+        posts = self.add_posts(self.user2, 2)
+        self.assertEqual(self.user1.timeline(10).items, [])
+        self.user1.follow(self.user2)
+        db.session.commit()
+        self.assertEqual(self.cached_ids(self.user1),
+                         [post.id for post in reversed(posts)] + [SENTINEL])
+        self.user1.unfollow(self.user2)
+        db.session.commit()
+        self.assertEqual(self.cached_ids(self.user1), [SENTINEL])
+
+    def test_pruning(self):
+        self.app.config['TIMELINE_LENGTH'] = 3
+        self.user1.follow(self.user2)
+        db.session.commit()
+        self.assertEqual(self.user1.timeline(10).items, [])
+        posts = self.add_posts(self.user2, 2)
+        self.assertEqual(self.cached_ids(self.user1),
+                         [post.id for post in reversed(posts)] + [SENTINEL])
+        posts += self.add_posts(self.user2, 2)
+        self.assertEqual(self.cached_ids(self.user1),
+                         [post.id for post in posts[:0:-1]])
+        self.assertEqual(self.user1.timeline(10).items, posts[::-1])
+
+    def test_celebrity_pull(self):
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        self.user1.follow(self.user2)
+        db.session.commit()
+        own, = self.add_posts(self.user1, 1)
+        self.assertEqual(self.user1.timeline(10).items, [own])
+        post, = self.add_posts(self.user2, 1)
+        self.assertEqual(get_celebrities(), [self.user2.id])
+        self.assertEqual(self.cached_ids(self.user1), [own.id, SENTINEL])
+        self.assertEqual(self.user1.timeline(10).items, [post, own])
+        page = self.user1.timeline(1)
+        self.assertEqual(page.items, [post])
+        self.assertEqual(self.user1.timeline(1, after=page.next_cursor).items,
+                         [own])
@@ -0,0 +1,80 @@
+import unittest
+from datetime import datetime
+
+from app import create_app, db
+from app.models import Message, User
+from app.unread import correct_unread, fill_unread, get_unread, \
+    unread_key, update_unread
+from config import Config
+from tests import requires_redis
+
+
+@requires_redis
+class UnreadCounterCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(Config)
+        self.app.config['UNREAD_COUNTER'] = True
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        self.app.redis.flushdb()
+        db.create_all()
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app.redis.flushdb()
+        self.app_context.pop()
+
+    def send(self, count):
+        db.session.add_all([Message(author=self.user1, recipient=self.user2,
+                                    body='hi {}'.format(i))
+                            for i in range(count)])
+        db.session.commit()
+
+    def test_fill(self):
+        self.send(2)
+        # Counters are only created by a count.
+        self.assertIsNone(get_unread(self.user2.id))
+        self.assertEqual(self.user2.unread_message_count(), 2)
+        self.assertEqual(get_unread(self.user2.id), 2)
+        self.assertGreater(self.app.redis.ttl(unread_key(self.user2.id)), 0)
+        fill_unread(self.user2.id, 5)
+        self.assertEqual(get_unread(self.user2.id), 2)
+
+    def test_update(self):
+        self.assertEqual(self.user2.unread_message_count(), 0)
+        self.send(3)
+        self.assertEqual(get_unread(self.user2.id), 3)
+        self.assertIsNone(get_unread(self.user1.id))
+        self.user2.last_message_read_time = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(get_unread(self.user2.id), 0)
+        self.user2.last_message_read_time = datetime.utcnow()
+        db.session.add(Message(author=self.user1, recipient=self.user2,
+                               body='hi'))
+        db.session.commit()
+        self.assertEqual(get_unread(self.user2.id), 1)
+        self.assertEqual(self.user2.new_messages(), 1)
+
+    def test_increment_script(self):
+        fill_unread(self.user2.id, 1)
+        update_unread({self.user1.id: 2, self.user2.id: 3}, set())
+        self.assertIsNone(get_unread(self.user1.id))
+        self.assertEqual(get_unread(self.user2.id), 4)
+
+    def test_reconcile(self):
+        self.send(2)
+        self.assertEqual(self.user2.unread_message_count(), 2)
+        self.assertEqual(self.user1.unread_message_count(), 0)
+        self.app.redis.set(unread_key(self.user2.id), 7)
+        self.assertEqual(User.reconcile_unread(), (2, 1))
+        self.assertEqual(get_unread(self.user2.id), 2)
+        self.assertEqual(User.reconcile_unread(), (2, 0))
+        # Counters that expired meanwhile are left to the next count.
+        self.app.redis.delete(unread_key(self.user1.id))
+        self.assertEqual(correct_unread({self.user1.id: 3}), 0)
+        self.assertIsNone(get_unread(self.user1.id))
@@ -4,7 +4,7 @@ import unittest
 from flask_restful import url_for
 
 from app import create_app, db
-from app.models import User
+from app.models import Message, User
 from config import Config
 from app.api.errors import exceptions
 
@@ -50,6 +50,46 @@ class UserAPITestCase(unittest.TestCase):
         data = User.query.get(self.user1.id).to_dict()
         self.assertEqual(json.loads(response.data), data)
 
+    def test_get_user_conditional(self):
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers=self.user1_token_auth_headers)
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        headers = dict(self.user1_token_auth_headers, **{
+            'If-None-Match': etag})
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.user1.about_me = 'changed'
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id),
+            headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_user_sparse_fields(self):
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id,
+                    fields='id,username'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(json.loads(response.data),
+                         {'id': self.user1.id, 'username': 'john'})
+        response = self.client.get(
+            url_for('api.user_list', fields='username'),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertIn({'username': 'Siri'}, data['items'])
+        self.assertIn('fields=username', data['_links']['self'])
+        response = self.client.get(
+            url_for('api.user_detail', user_id=self.user1.id,
+                    fields='password_hash'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_get_user_token_auth_required(self):
         response = self.client.get(
             url_for('api.user_detail', user_id=self.user1.id))
@@ -76,6 +116,86 @@ class UserAPITestCase(unittest.TestCase):
         self.assertIn(self.user1.to_dict(), data['items'])
         self.assertIn(self.user2.to_dict(), data['items'])
 
+    def test_get_users_total_modes(self):
+        response = self.client.get(
+            url_for('api.user_list', total='none', per_page=1),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertIsNone(data['_meta']['total_items'])
+        self.assertIsNone(data['_meta']['total_pages'])
+        self.assertIn('total=none', data['_links']['next'])
+        response = self.client.get(
+            url_for('api.user_list', total='estimate'),
+            headers=self.user1_token_auth_headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['_meta']['total_items'], 2)
+        self.assertTrue(data['_meta']['total_estimated'])
+        response = self.client.get(
+            url_for('api.user_list', total='approximately'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_users_by_ids(self):
+        ids = '{},100,{},{}'.format(self.user2.id, self.user1.id,
+                                    self.user2.id)
+        response = self.client.get(
+            url_for('api.user_list', ids=ids),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['items'],
+                         [self.user2.to_dict(), self.user1.to_dict()])
+        self.assertEqual(data['_meta'], {'requested': 3, 'missing': [100]})
+        response = self.client.get(
+            url_for('api.user_list', ids='1,two'),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_suggest_users(self):
+        response = self.client.get(url_for('api.user_suggest', q='jo'))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(url_for('api.user_suggest', q='jo'),
+                                   headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        # The prefix index is disabled in tests, the table is never scanned.
+        self.assertEqual(json.loads(response.data)['items'], [])
+
+    def test_conversations(self):
+        user3 = User(username='susan', email='susan@example.com')
+        db.session.add(user3)
+        db.session.add_all([
+            Message(author=self.user1, recipient=self.user2, body='hi'),
+            Message(author=self.user2, recipient=self.user1, body='hello'),
+            Message(author=user3, recipient=self.user1, body='hey')])
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.conversation_list', user_id=self.user1.id),
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIsNone(data['_meta']['total_items'])
+        self.assertEqual(
+            [(item['other_user_id'], item['last_message']['body'])
+             for item in data['items']],
+            [(user3.id, 'hey'), (self.user2.id, 'hello')])
+        response = self.client.get(
+            data['items'][1]['_links']['messages'],
+            headers=self.user1_token_auth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['body'] for item in json.loads(response.data)['items']],
+            ['hello', 'hi'])
+        response = self.client.get(
+            url_for('api.conversation_list', user_id=self.user1.id),
+            headers=self.user2_token_auth_headers)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            data['items'][0]['_links']['messages'].replace(
+                '/users/{}/'.format(self.user1.id),
+                '/users/{}/'.format(self.user2.id)),
+            headers=self.user2_token_auth_headers)
+        self.assertEqual(response.status_code, 404)
+
     def test_get_users_token_auth_required(self):
         response = self.client.get(url_for('api.user_list'), headers={})
         self.assertEqual(response.status_code, 401)
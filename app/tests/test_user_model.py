@@ -4,7 +4,10 @@ from datetime import datetime, timedelta
 from flask_restful import url_for
 
 from app import create_app, db
-from app.models import User, Post
+from app.identity import clear_user_cache
+from app.models import IndexedPost, Message, User, Post, SearchOutbox
+from app.pagination import InvalidCursor
+from app.search import decode_cursor
 from config import Config
 
 
@@ -20,6 +23,8 @@ class UserModelCase(unittest.TestCase):
         db.session.commit()
 
     def tearDown(self):
+        # Cleanups such as clear_user_cache need the application context.
+        self.doCleanups()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
@@ -29,6 +34,20 @@ class UserModelCase(unittest.TestCase):
         self.assertFalse(self.user1.check_password('dog'))
         self.assertTrue(self.user1.check_password('cat'))
 
+    def test_password_rehash(self):
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        self.user1.set_password('cat')
+        self.assertTrue(
+            self.user1.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertFalse(self.user1.check_password('dog'))
+        self.assertTrue(
+            self.user1.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(self.user1.check_password('cat'))
+        self.assertTrue(
+            self.user1.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(self.user1.check_password('cat'))
+
     def test_avatar(self):
         base_url = 'https://www.gravatar.com/avatar/'
         self.assertEqual(
@@ -68,6 +87,58 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(posts1, [p2, p1])
         self.assertEqual(posts2, [p2, p1])
 
+    def test_timeline(self):
+        now = datetime.utcnow()
+        p1 = Post(
+            body='Post from john', author=self.user1,
+            timestamp=now + timedelta(seconds=1))
+        p2 = Post(
+            body='Post from susan', author=self.user2,
+            timestamp=now + timedelta(seconds=4))
+        db.session.add_all([p1, p2])
+        self.user1.follow(self.user2)
+        db.session.commit()
+        page1 = self.user1.timeline(1)
+        self.assertEqual(page1.items, [p2])
+        self.assertTrue(page1.has_next)
+        self.assertFalse(page1.has_prev)
+        page2 = self.user1.timeline(1, after=page1.next_cursor)
+        self.assertEqual(page2.items, [p1])
+        self.assertFalse(page2.has_next)
+        self.assertTrue(page2.has_prev)
+        self.assertEqual(
+            self.user1.timeline(1, before=page2.prev_cursor).items, [p2])
+        self.assertEqual(self.user1.timeline(1, page=2).items, [p1])
+        self.assertEqual(self.user2.timeline(10).items, [p2])
+
+    def test_counters(self):
+        self.user1.follow(self.user2)
+        db.session.add(Post(body='Post from john', author=self.user1))
+        db.session.commit()
+        self.assertEqual(self.user1.post_count, 1)
+        self.assertEqual(self.user1.followed_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
+        post = self.user1.posts.first()
+        self.user1.unfollow(self.user2)
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.user1.post_count, 0)
+        self.assertEqual(self.user1.followed_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
+
+    def test_repair_counters(self):
+        self.user1.follow(self.user2)
+        db.session.commit()
+        self.user1.followed_count = 5
+        self.user2.post_count = 3
+        db.session.commit()
+        repaired = User.repair_counters()
+        self.assertEqual(repaired['followed_count'], 1)
+        self.assertEqual(repaired['post_count'], 1)
+        self.assertEqual(repaired['follower_count'], 0)
+        self.assertEqual(self.user1.followed_count, 1)
+        self.assertEqual(self.user2.post_count, 0)
+
     def test_user_to_dict(self):
         data = {
             'id': self.user1.id,
@@ -88,3 +159,124 @@ class UserModelCase(unittest.TestCase):
         }
         data1 = User.query.get_or_404(self.user1.id).to_dict()
         self.assertEqual(data, data1)
+
+    def test_user_serializer(self):
+        user = User.query.get(self.user1.id)
+        self.assertEqual(User.serializer()(user), user.to_dict())
+        row = User.query.with_entities(*User.serializer().columns).filter_by(
+            id=self.user1.id).one()
+        self.assertEqual(User.serializer(include_email=True)(row),
+                         user.to_dict(include_email=True))
+
+    def test_identity_cache(self):
+        self.app.config['USER_CACHE'] = True
+        self.addCleanup(clear_user_cache)
+        user_id = self.user1.id
+        self.user1.set_password('cat')
+        db.session.commit()
+        db.session.expunge_all()
+        user = User.load_by_username('john')
+        self.assertEqual(user.id, user_id)
+        db.session.expunge_all()
+        user = User.load(user_id)
+        self.assertEqual(user.email, 'john@example.com')
+        self.assertNotIn('password_hash', user.__dict__)
+        self.assertTrue(user.check_password('cat'))
+        user.username = 'johnny'
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertIsNone(User.load_by_username('john'))
+        self.assertEqual(User.load_by_username('johnny').id, user_id)
+        db.session.add(Post(body='post', author=User.load(user_id)))
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertEqual(User.load(user_id).post_count, 1)
+
+    def test_search_outbox_drain(self):
+        post = Post(body='Post from john', author=self.user1)
+        db.session.add(post)
+        db.session.commit()
+        db.session.add_all([SearchOutbox(index_name='post', doc_id=post.id),
+                            SearchOutbox(index_name='post', doc_id=post.id),
+                            SearchOutbox(index_name='gone', doc_id=1)])
+        db.session.commit()
+        self.assertEqual(SearchOutbox.drain(), (2, 0))
+        self.assertEqual(SearchOutbox.query.count(), 0)
+        self.assertEqual(SearchOutbox.drain(), (0, 0))
+
+    def test_database_search(self):
+        post1 = Post(body='Cats are great', author=self.user1)
+        post2 = Post(body='Dogs are great too', author=self.user2)
+        db.session.add_all([post1, post2])
+        db.session.commit()
+        posts, cursor = Post.search('cats', 10)
+        self.assertEqual([post.id for post in posts], [post1.id])
+        self.assertIsNone(cursor)
+        post1.body = 'Birds'
+        db.session.delete(post2)
+        db.session.commit()
+        self.assertEqual(Post.search('great', 10)[0], [])
+        self.assertEqual(len(Post.search('birds', 10)[0]), 1)
+        db.session.add(Post(body='Birds again', author=self.user2))
+        db.session.rollback()
+        self.assertEqual(len(Post.search('birds', 10)[0]), 1)
+
+    def test_search_results_from_index(self):
+        post = Post(body='Cats are great', author=self.user1)
+        db.session.add(post)
+        db.session.commit()
+        posts, _ = Post.search('cats', 10)
+        self.assertIsInstance(posts[0], IndexedPost)
+        self.assertEqual(posts[0].body, 'Cats are great')
+        self.assertEqual(posts[0].timestamp, post.timestamp)
+        self.assertEqual(posts[0].author.avatar(36), self.user1.avatar(36))
+        self.user1.username = 'johnny'
+        db.session.commit()
+        self.assertEqual(Post.search('cats', 10)[0][0].author.username,
+                         'johnny')
+        self.app.config['SEARCH_STORE_SOURCE'] = False
+        Post.reindex(echo=lambda message: None)
+        self.assertEqual(Post.search('cats', 10)[0], [post])
+
+    def test_search_cursors(self):
+        db.session.add_all([Post(body='cats {}'.format(i), author=self.user1)
+                            for i in range(5)])
+        db.session.commit()
+        seen = []
+        posts, cursor = Post.search('  CATS ', 2)
+        while True:
+            self.assertTrue(posts)
+            seen += [post.id for post in posts]
+            if cursor is None:
+                break
+            posts, cursor = Post.search('cats', 2, after=cursor)
+        self.assertEqual(sorted(seen, reverse=True), seen)
+        self.assertEqual(len(set(seen)), 5)
+        # Later pages are not searched without the cursor leading to them.
+        with self.assertRaises(InvalidCursor):
+            Post.search('cats', 2, page=2)
+
+    def test_search_cursors_across_ranks(self):
+        db.session.add_all([
+            Post(body='cats ' * (i % 4 + 1) + 'and dogs {}'.format(i),
+                 author=self.user1) for i in range(9)])
+        db.session.commit()
+        seen = []
+        posts, cursor = Post.search('cats', 2)
+        while cursor is not None:
+            self.assertIsInstance(decode_cursor(cursor)[0], str)
+            seen += [post.id for post in posts]
+            posts, cursor = Post.search('cats', 2, after=cursor)
+        seen += [post.id for post in posts]
+        self.assertEqual(len(seen), 9)
+        self.assertEqual(len(set(seen)), 9)
+
+    def test_unread_message_count(self):
+        db.session.add_all([Message(author=self.user1, recipient=self.user2,
+                                    body='hi {}'.format(i)) for i in range(3)])
+        db.session.commit()
+        self.assertEqual(self.user2.unread_message_count(), 3)
+        self.assertEqual(self.user1.unread_message_count(), 0)
+        self.user2.last_message_read_time = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(self.user2.unread_message_count(), 0)